@@ -0,0 +1,213 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import pickle
+import xml.etree.ElementTree as ET
+
+import traci
+
+from vehicle import TrafficLightState
+
+CHECKPOINT_LOCATION = "output/checkpoints/{0}_{1}"
+MANIFEST_NAME = "latest.json"
+TRIPINFO_SEGMENT_NAME = "tripinfo_%s.xml"
+
+
+class Checkpointer:
+    """
+    Periodically pairs a SUMO saved state with a pickled snapshot of the controller
+    objects (the SimulationManager along with its Vehicles, TrafficLights and corridor
+    plans, plus any other controllers such as platoons or intersection controllers).
+
+    Both files are gzip compressed and written under a temporary name before being
+    renamed into place, and the manifest naming the pair is only replaced once both
+    exist, so a crash at any point leaves the previous checkpoint usable.
+
+    The manifest also names the tripinfo output this run writes (tripinfoFile) and those
+    of the earlier runs it continues (tripinfoSegments, as (file, until time) pairs), so a
+    resumed run can put the trips finished before the checkpoint back (see mergeTripinfo).
+    """
+
+    def __init__(self, directory, interval, keep=2, tripinfoSegments=(), tripinfoFile=None):
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.tripinfoSegments = list(tripinfoSegments)
+        self.tripinfoFile = tripinfoFile
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, step, manager, controllers=()):
+        """Checkpoints the simulation and controllers as they are after the given step"""
+        stateFile = os.path.join(self.directory, "state_%s.xml.gz" % step)
+        # SUMO picks the compression from the extension, so keep it on the temporary name
+        temporaryStateFile = os.path.join(self.directory, "state_%s.tmp.xml.gz" % step)
+        traci.simulation.saveState(temporaryStateFile)
+        os.replace(temporaryStateFile, stateFile)
+
+        snapshot = {
+            "manager": manager,
+            "controllers": list(controllers),
+            "trafficLights": _captureTrafficLights(manager),
+        }
+        controllerFile = os.path.join(self.directory, "controllers_%s.pickle.gz" % step)
+        _writeAtomically(
+            controllerFile,
+            gzip.compress(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)),
+        )
+
+        manifest = {
+            "step": step,
+            "time": traci.simulation.getTime(),
+            "state": os.path.basename(stateFile),
+            "controllers": os.path.basename(controllerFile),
+            "tripinfo": os.path.basename(self.tripinfoFile) if self.tripinfoFile else None,
+            "earlierTripinfo": [
+                [os.path.basename(segment), until] for segment, until in self.tripinfoSegments
+            ],
+        }
+        _writeAtomically(
+            os.path.join(self.directory, MANIFEST_NAME),
+            json.dumps(manifest).encode(),
+        )
+        self._prune(step)
+        logging.info("Checkpoint written at step %s (time %s)", step, manifest["time"])
+
+    def _prune(self, latestStep):
+        """Removes all but the newest checkpoints"""
+        steps = sorted(
+            int(os.path.basename(f)[len("state_"):-len(".xml.gz")])
+            for f in glob.glob(os.path.join(self.directory, "state_*.xml.gz"))
+            if ".tmp." not in f
+        )
+        for step in steps[: -self.keep]:
+            if step == latestStep:
+                continue
+            for name in ("state_%s.xml.gz", "controllers_%s.pickle.gz"):
+                path = os.path.join(self.directory, name % step)
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def readCheckpoint(directory):
+    """
+    Returns the latest checkpoint manifest in the given directory, with the state
+    file resolved to a full path, or None if there is no checkpoint. tripinfoSegments
+    lists the tripinfo outputs of the runs up to the checkpoint and when each was cut off.
+    """
+    manifestFile = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifestFile):
+        return None
+    with open(manifestFile) as f:
+        manifest = json.load(f)
+    manifest["state"] = os.path.join(directory, manifest["state"])
+    manifest["controllers"] = os.path.join(directory, manifest["controllers"])
+    manifest["tripinfoSegments"] = [
+        (os.path.join(directory, segment), until) for segment, until in manifest.get("earlierTripinfo", ())
+    ]
+    if manifest.get("tripinfo"):
+        manifest["tripinfoSegments"].append((os.path.join(directory, manifest["tripinfo"]), manifest["time"]))
+    return manifest
+
+
+def tripinfoSegment(directory, step):
+    """The tripinfo output of a checkpointed run starting from the given step"""
+    return os.path.join(directory, TRIPINFO_SEGMENT_NAME % step)
+
+
+def mergeTripinfo(tripinfoSegments, tripinfoFile, outputFile):
+    """
+    Writes the trips of earlier runs that finished before each was cut off, followed by
+    the trips in tripinfoFile, to outputFile as a single tripinfo output
+    """
+    root = ET.Element("tripinfos")
+    for segment, until in tripinfoSegments:
+        root.extend(trip for trip in _readTrips(segment) if float(trip.get("arrival")) <= until)
+    root.extend(_readTrips(tripinfoFile))
+    ET.ElementTree(root).write(outputFile, encoding="UTF-8", xml_declaration=True)
+
+
+def _readTrips(tripinfoFile):
+    trips = []
+    try:
+        for _, element in ET.iterparse(tripinfoFile):
+            if element.tag == "tripinfo":
+                trips.append(element)
+    except ET.ParseError:
+        # A run that crashed may not have closed its output
+        logging.warning("%s ends early, keeping the trips before that", tripinfoFile)
+    return trips
+
+
+def restoreControllers(manifest):
+    """
+    Rebuilds the controller objects from a checkpoint once SUMO has been started with
+    its saved state, returning the manager and any other checkpointed controllers
+    """
+    with open(manifest["controllers"], "rb") as f:
+        snapshot = pickle.loads(gzip.decompress(f.read()))
+    manager = snapshot["manager"]
+    if manager:
+        manager.restoreSubscriptions()
+    _restoreTrafficLights(snapshot["trafficLights"])
+    logging.info("Resumed controllers from step %s (time %s)", manifest["step"], manifest["time"])
+    return manager, snapshot["controllers"]
+
+
+def _captureTrafficLights(manager):
+    """
+    SUMO's saved state only records which program and phase a light is on, not programs
+    uploaded through TraCI, so the forced and biased lights are captured explicitly
+    """
+    trafficLights = {}
+    if not manager:
+        return trafficLights
+    for vehicle_id, emergency_vehicle in manager.emergency_vehicles.items():
+        for traffic_light in emergency_vehicle._traffic_lights_on_route:
+            if traffic_light.status is TrafficLightState.FORCED:
+                trafficLights[traffic_light.id] = (
+                    traffic_light.status,
+                    vehicle_id,
+                    traci.trafficlight.getRedYellowGreenState(traffic_light.id),
+                    None,
+                )
+            elif traffic_light.status is TrafficLightState.BIASED:
+                programID = traci.trafficlight.getProgram(traffic_light.id)
+                logic = next(
+                    logic
+                    for logic in traci.trafficlight.getAllProgramLogics(traffic_light.id)
+                    if logic.programID == programID
+                )
+                trafficLights[traffic_light.id] = (
+                    traffic_light.status,
+                    vehicle_id,
+                    logic,
+                    (
+                        traci.trafficlight.getPhase(traffic_light.id),
+                        traci.trafficlight.getNextSwitch(traffic_light.id)
+                        - traci.simulation.getTime(),
+                    ),
+                )
+    return trafficLights
+
+
+def _restoreTrafficLights(trafficLights):
+    for traffic_light_id, (status, vehicle_id, program, phase) in trafficLights.items():
+        if status is TrafficLightState.FORCED:
+            traci.trafficlight.setRedYellowGreenState(traffic_light_id, program)
+            traci.vehicle.setLaneChangeMode(vehicle_id, 0)
+        else:
+            phaseIndex, remainingDuration = phase
+            traci.trafficlight.setProgramLogic(traffic_light_id, program)
+            traci.trafficlight.setPhase(traffic_light_id, phaseIndex)
+            traci.trafficlight.setPhaseDuration(traffic_light_id, remainingDuration)
+
+
+def _writeAtomically(path, data):
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaryPath, path)
@@ -0,0 +1,158 @@
+import logging
+from bisect import bisect_right
+
+import traci
+
+from vehicle import TrafficLightState
+
+
+class CorridorPlanner:
+    """
+    Plans a green-wave corridor for a single emergency vehicle.
+
+    When the vehicle departs, the expected speed profile along its route is used to
+    work out when each traffic light on the route needs to be biased, forced and
+    cleared. The actions are then replayed from a sorted schedule, so between
+    corrections a step only compares the current time against the next action.
+    Every ``check_interval`` seconds the measured odometer is compared to the plan
+    and, if the ETA has drifted by more than ``drift_tolerance`` seconds, the whole
+    remaining schedule is shifted by the measured drift.
+    """
+
+    BIAS = 0
+    FORCE = 1
+    CLEAR = 2
+
+    def __init__(
+        self,
+        vehicle,
+        force_threshold,
+        bias_threshold,
+        bias_multiplier,
+        drift_tolerance=2.0,
+        check_interval=1.0,
+        clear_delay=2.0,
+    ):
+        self.vehicle = vehicle
+        self.force_threshold = force_threshold
+        self.bias_threshold = bias_threshold
+        self.bias_multiplier = bias_multiplier
+        self.drift_tolerance = drift_tolerance
+        self.check_interval = check_interval
+        self.clear_delay = clear_delay
+        self.corrections = 0
+        self._offset = 0
+        self._next_action = 0
+        self._plan_distances = []
+        self._plan_times = []
+        self._actions = []
+        self._next_check = 0
+        self.plan()
+
+    def plan(self):
+        """
+        Builds the distance/time speed profile for the rest of the route and the
+        schedule of light actions derived from it
+        """
+        vehicle_id = self.vehicle.id
+        route = self.vehicle._route
+        now = traci.simulation.getTime()
+        route_index = traci.vehicle.getRouteIndex(vehicle_id)
+        max_speed = traci.vehicle.getMaxSpeed(vehicle_id)
+        speed_factor = traci.vehicle.getSpeedFactor(vehicle_id)
+
+        # The profile is keyed on the vehicle's odometer so corrections only need
+        # a single getDistance call
+        distance = traci.vehicle.getDistance(vehicle_id)
+        lane_position = traci.vehicle.getLanePosition(vehicle_id)
+        self._plan_distances = [distance]
+        self._plan_times = [now]
+        edge_end_distances = {}
+        for i in range(route_index, len(route)):
+            lane = f"{route[i]}_0"
+            length = traci.lane.getLength(lane)
+            if i == route_index:
+                length = max(length - lane_position, 0)
+            speed = min(max_speed, traci.lane.getMaxSpeed(lane) * speed_factor) or 1
+            distance += length
+            self._plan_distances.append(distance)
+            self._plan_times.append(self._plan_times[-1] + length / speed)
+            edge_end_distances[i] = distance
+
+        actions = []
+        for traffic_light in self.vehicle._traffic_lights_on_route:
+            traffic_light_index = traffic_light.route_index
+            if traffic_light_index < route_index:
+                continue
+            stop_line = edge_end_distances[traffic_light_index]
+            if self.vehicle.bias_mode and self.bias_threshold > self.force_threshold:
+                actions.append((self._time_at(stop_line - self.bias_threshold), self.BIAS, traffic_light))
+            actions.append((self._time_at(stop_line - self.force_threshold), self.FORCE, traffic_light))
+            actions.append((self._time_at(stop_line) + self.clear_delay, self.CLEAR, traffic_light))
+        actions.sort(key=lambda action: (action[0], action[1]))
+
+        self._actions = actions
+        self._next_action = 0
+        self._offset = 0
+        self._next_check = now + self.check_interval
+        logging.info(
+            "Planned corridor for %s: %s actions over %s traffic lights, ETA %.1f",
+            vehicle_id,
+            len(actions),
+            len(self.vehicle._traffic_lights_on_route),
+            self._plan_times[-1],
+        )
+
+    def step(self, now):
+        """Performs any actions that are due, correcting the schedule if the vehicle has drifted"""
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._correct(now)
+
+        while self._next_action < len(self._actions):
+            planned_time, action, traffic_light = self._actions[self._next_action]
+            if planned_time + self._offset > now:
+                break
+            self._next_action += 1
+            self._perform(action, traffic_light)
+
+    def eta(self):
+        """Predicted arrival time at the end of the route, including the current correction"""
+        return self._plan_times[-1] + self._offset
+
+    def _correct(self, now):
+        measured_distance = traci.vehicle.getDistance(self.vehicle.id)
+        drift = now - self._time_at(measured_distance)
+        if abs(drift - self._offset) > self.drift_tolerance:
+            logging.info(
+                "Corridor for %s drifted by %.1fs, shifting remaining schedule",
+                self.vehicle.id,
+                drift,
+            )
+            self._offset = drift
+            self.corrections += 1
+
+    def _perform(self, action, traffic_light):
+        if action == self.BIAS:
+            if traffic_light.status is TrafficLightState.NONE:
+                traffic_light.bias(self.bias_multiplier, self.vehicle._route_edge_pairs)
+        elif action == self.FORCE:
+            if traffic_light.status is not TrafficLightState.FORCED:
+                traffic_light.force(self.vehicle.id, self.vehicle._route_edge_pairs)
+        elif traffic_light.status is not TrafficLightState.NONE:
+            traffic_light.clear(self.vehicle.id)
+
+    def _time_at(self, distance):
+        """Linearly interpolates the planned time at which the odometer reaches the given distance"""
+        distances = self._plan_distances
+        times = self._plan_times
+        if distance <= distances[0]:
+            return times[0]
+        i = bisect_right(distances, distance)
+        if i >= len(distances):
+            return times[-1]
+        span = distances[i] - distances[i - 1]
+        if not span:
+            return times[i]
+        ratio = (distance - distances[i - 1]) / span
+        return times[i - 1] + ratio * (times[i] - times[i - 1])
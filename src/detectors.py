@@ -0,0 +1,182 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+import sumolib
+
+DETECTOR_CACHE_LOCATION = "output/detectors"
+# Only emergency vehicles should ever trigger a preemption detector
+DETECTOR_VEHICLE_TYPES = "ambulance"
+# How much of each lane next to a traffic light is covered by a queue detector
+QUEUE_DETECTOR_LENGTH = 100
+
+
+def getPreemptionDetectorFile(mainProjectDirectory, mapName, netFile, forceThreshold, biasThreshold):
+    """
+    Returns the location of the preemption detector file for the given map and threshold
+    set, generating it if it is not cached or the net file has changed since it was made.
+    """
+    return _getCachedDetectorFile(
+        mainProjectDirectory,
+        "{0}_f{1}_b{2}.add.xml".format(mapName, forceThreshold, biasThreshold),
+        netFile,
+        lambda detectorFile: generatePreemptionDetectors(netFile, detectorFile, forceThreshold, biasThreshold),
+    )
+
+
+def getQueueDetectorFile(mainProjectDirectory, mapName, netFile):
+    """
+    Returns the location of the queue detector file for the given map, generating it if
+    it is not cached or the net file has changed since it was made.
+    """
+    return _getCachedDetectorFile(
+        mainProjectDirectory,
+        "{0}_queues.add.xml".format(mapName),
+        netFile,
+        lambda detectorFile: generateQueueDetectors(netFile, detectorFile),
+    )
+
+
+def _getCachedDetectorFile(mainProjectDirectory, fileName, netFile, generate):
+    cacheDirectory = "{0}/{1}".format(mainProjectDirectory, DETECTOR_CACHE_LOCATION)
+    detectorFile = "{0}/{1}".format(cacheDirectory, fileName)
+    if os.path.exists(detectorFile) and os.path.getmtime(detectorFile) >= os.path.getmtime(netFile):
+        logging.info("Using cached detectors %s", detectorFile)
+        return detectorFile
+    os.makedirs(cacheDirectory, exist_ok=True)
+    generate(detectorFile)
+    return detectorFile
+
+
+def generatePreemptionDetectors(netFile, detectorFile, forceThreshold, biasThreshold):
+    """
+    Writes an additional file with induction loops across every approach of every
+    traffic light at the force and bias thresholds upstream of the stop line, plus a
+    clear loop just after the junction on every exit lane.
+    Each loop carries params naming the traffic light, the kind of action it triggers
+    and the edge it guards so the controllers do not need to compute any distances.
+    """
+    net = sumolib.net.readNet(netFile)
+    thresholds = [("force", forceThreshold)]
+    if biasThreshold > forceThreshold:
+        thresholds.append(("bias", biasThreshold))
+
+    root = ET.Element("additional")
+    count = 0
+
+    def addDetector(kind, lane, position, trafficLightId, edge):
+        nonlocal count
+        loop = ET.SubElement(
+            root,
+            "inductionLoop",
+            id="preempt_%s_%s" % (kind, count),
+            lane=lane.getID(),
+            pos="%.2f" % position,
+            period="86400",
+            file="NUL",
+            vTypes=DETECTOR_VEHICLE_TYPES,
+        )
+        ET.SubElement(loop, "param", key="tls", value=trafficLightId)
+        ET.SubElement(loop, "param", key="kind", value=kind)
+        ET.SubElement(loop, "param", key="edge", value=edge)
+        count += 1
+
+    for trafficLight in net.getTrafficLights():
+        approachEdges = set()
+        exitLanes = set()
+        for connection in trafficLight.getConnections():
+            approachEdges.add(connection[0].getEdge())
+            exitLanes.add(connection[1])
+        for approachEdge in approachEdges:
+            for kind, threshold in thresholds:
+                # Cover every lane as the emergency vehicle can approach in any of them
+                for edge, position in _upstreamPositions(approachEdge, threshold):
+                    for lane in edge.getLanes():
+                        addDetector(kind, lane, position, trafficLight.getID(), approachEdge.getID())
+        for exitLane in exitLanes:
+            addDetector(
+                "clear",
+                exitLane,
+                min(1.0, exitLane.getLength() / 2),
+                trafficLight.getID(),
+                exitLane.getEdge().getID(),
+            )
+
+    ET.ElementTree(root).write(detectorFile)
+    logging.info("Generated %s preemption detectors in %s", count, detectorFile)
+
+
+def generateQueueDetectors(netFile, detectorFile):
+    """
+    Writes an additional file with a lane area detector on every lane entering or leaving
+    a traffic light, covering up to QUEUE_DETECTOR_LENGTH metres before the stop line of
+    incoming lanes and after the start of outgoing lanes. Each detector is named after
+    its lane so the queue of a lane can be looked up directly.
+    """
+    net = sumolib.net.readNet(netFile)
+    incomingLanes = set()
+    outgoingLanes = set()
+    for trafficLight in net.getTrafficLights():
+        for connection in trafficLight.getConnections():
+            incomingLanes.add(connection[0])
+            outgoingLanes.add(connection[1])
+
+    root = ET.Element("additional")
+    for lane in sorted(incomingLanes | outgoingLanes, key=lambda l: l.getID()):
+        length = min(QUEUE_DETECTOR_LENGTH, lane.getLength())
+        # A lane both leaving one light and entering another is measured at its far end
+        position = lane.getLength() - length if lane in incomingLanes else 0
+        ET.SubElement(
+            root,
+            "laneAreaDetector",
+            id=queueDetectorID(lane.getID()),
+            lane=lane.getID(),
+            pos="%.2f" % position,
+            length="%.2f" % length,
+            period="86400",
+            file="NUL",
+        )
+    ET.ElementTree(root).write(detectorFile)
+    logging.info("Generated %s queue detectors in %s", len(root), detectorFile)
+
+
+def queueDetectorID(lane):
+    return "queue_%s" % lane
+
+
+def readPreemptionDetectors(detectorFile):
+    """
+    Reads back a generated detector file, returning a dict of
+    detector id -> (traffic light id, kind, guarded edge, detector edge)
+    """
+    detectors = {}
+    for loop in ET.parse(detectorFile).getroot().iter("inductionLoop"):
+        params = {param.get("key"): param.get("value") for param in loop.iter("param")}
+        detectors[loop.get("id")] = (
+            params["tls"],
+            params["kind"],
+            params["edge"],
+            loop.get("lane").rsplit("_", 1)[0],
+        )
+    return detectors
+
+
+def _upstreamPositions(edge, distance, visited=None):
+    """
+    Walks upstream from the end of the given edge until the given distance has been
+    covered, returning the (edge, position) pairs where it ran out. Junction lengths are
+    ignored in the same way as Vehicle.calculate_traffic_light_distances.
+    """
+    if edge.getLength() >= distance:
+        return [(edge, edge.getLength() - distance)]
+    visited = visited or set()
+    visited.add(edge.getID())
+    remaining = distance - edge.getLength()
+    positions = []
+    for incomingEdge in edge.getIncoming():
+        if incomingEdge.getID() not in visited:
+            positions.extend(_upstreamPositions(incomingEdge, remaining, visited))
+    if not positions:
+        # Nothing further upstream, so trigger as early as the network allows
+        positions.append((edge, 0))
+    return positions
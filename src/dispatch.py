@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import queue
+import threading
+
+import traci
+
+DEFAULT_DISPATCH_PORT = 8813
+
+
+class DispatchService:
+    """
+    Accepts emergency vehicle dispatches on a localhost socket while a simulation runs.
+
+    Clients send one JSON object per line, e.g.
+        {"origin": "NewIn", "destination": "A12NorthOut", "priority": 2, "request": "call-17"}
+    and receive JSON lines back on the same connection:
+        {"type": "queued", ...} as soon as the request is accepted,
+        {"type": "dispatched", "vehicle": ..., "eta": ...} once it has been injected and
+        {"type": "arrived", "vehicle": ..., "time": ..., "travelTime": ...} when it arrives.
+
+    The socket is served by an asyncio loop on its own thread, which only puts requests
+    on a queue, so the step loop is never blocked. handleStepBoundary (called by the step
+    loop) injects up to maxPerStep queued requests, highest priority first, and reports
+    arrivals, batching all replies for a step into a single hand-over to the socket thread.
+    """
+
+    def __init__(self, manager=None, host="127.0.0.1", port=DEFAULT_DISPATCH_PORT, maxPerStep=20, typeID="ambulance", vehicleParameters=None):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.maxPerStep = maxPerStep
+        self.typeID = typeID
+        self.vehicleParameters = vehicleParameters or {}
+        self._requests = queue.SimpleQueue()
+        self._backlog = []
+        self._sequence = itertools.count()
+        self._vehicleNumbers = itertools.count()
+        self._vehiclePrefix = "dispatch"
+        self._inFlight = {}
+        self._clients = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Starts serving on a background thread, returning once the socket is listening"""
+        # A run resumed from a checkpoint counts its vehicles from zero again, so the time it
+        # started from keeps their ids apart from the dispatches made before the checkpoint
+        self._vehiclePrefix = "dispatch_%g" % traci.simulation.getTime()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="dispatch", daemon=True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handleClient, self.host, self.port), self._loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Dispatch service listening on %s:%s", self.host, self.port)
+
+    def stop(self):
+        if not self._loop:
+            return
+
+        async def shutdown():
+            self._server.close()
+            # Closing a client's connection ends its readline() rather than cancelling it
+            for writer in self._clients.values():
+                writer.close()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _handleClient(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            await self._readRequests(reader, writer)
+        finally:
+            del self._clients[task]
+            writer.close()
+
+    async def _readRequests(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                origin = request["origin"]
+                destination = request["destination"]
+                priority = float(request.get("priority", 0))
+                if not math.isfinite(priority):
+                    raise ValueError("Priority %r is not finite" % priority)
+            except (ValueError, KeyError, TypeError):
+                self._write(writer, [{"type": "error", "message": "Could not parse dispatch %r" % line}])
+                continue
+            reference = request.get("request")
+            self._requests.put((-priority, origin, destination, reference, writer))
+            self._write(writer, [{"type": "queued", "request": reference}])
+
+    @staticmethod
+    def _write(writer, messages):
+        if writer.is_closing():
+            return
+        writer.write(b"".join(json.dumps(m).encode() + b"\n" for m in messages))
+
+    def handleStepBoundary(self):
+        """Injects queued dispatches and reports arrivals, to be called between simulation steps"""
+        while True:
+            try:
+                priority, *request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            heapq.heappush(self._backlog, (priority, next(self._sequence), *request))
+
+        replies = {}
+        if self._backlog:
+            now = traci.simulation.getTime()
+            for _ in range(min(self.maxPerStep, len(self._backlog))):
+                _, _, origin, destination, reference, writer = heapq.heappop(self._backlog)
+                replies.setdefault(writer, []).append(
+                    self._inject(now, origin, destination, reference, writer)
+                )
+
+        if self._inFlight:
+            arrived = traci.simulation.getArrivedIDList()
+            if arrived:
+                now = traci.simulation.getTime()
+                for vehicle_id in arrived:
+                    dispatch = self._inFlight.pop(vehicle_id, None)
+                    if dispatch:
+                        reference, writer, dispatched, eta = dispatch
+                        replies.setdefault(writer, []).append(
+                            {
+                                "type": "arrived",
+                                "request": reference,
+                                "vehicle": vehicle_id,
+                                "time": now,
+                                "travelTime": now - dispatched,
+                                "eta": eta,
+                            }
+                        )
+
+        if replies:
+            self._loop.call_soon_threadsafe(self._writeReplies, replies)
+
+    def _writeReplies(self, replies):
+        for writer, messages in replies.items():
+            self._write(writer, messages)
+
+    def _inject(self, now, origin, destination, reference, writer):
+        try:
+            stage = traci.simulation.findRoute(origin, destination, vType=self.typeID)
+            if not stage.edges:
+                raise traci.TraCIException("No route found from %s to %s" % (origin, destination))
+            vehicle_id = "%s_%s" % (self._vehiclePrefix, next(self._vehicleNumbers))
+            route_id = "%s_route" % vehicle_id
+            traci.route.add(route_id, stage.edges)
+            traci.vehicle.add(vehID=vehicle_id, routeID=route_id, typeID=self.typeID, departSpeed="max")
+            for key, value in self.vehicleParameters.items():
+                traci.vehicle.setParameter(vehicle_id, key, value)
+        except traci.TraCIException as e:
+            logging.error("Could not dispatch %s from %s to %s: %s", reference, origin, destination, e)
+            return {"type": "error", "request": reference, "message": str(e)}
+
+        if self.manager:
+            self.manager.registerEmergencyVehicle(vehicle_id)
+        eta = now + stage.travelTime
+        self._inFlight[vehicle_id] = (reference, writer, now, eta)
+        return {"type": "dispatched", "request": reference, "vehicle": vehicle_id, "time": now, "eta": eta}
@@ -0,0 +1,123 @@
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+
+import traci
+
+from scenario_manager import getScenarioConfigs, SCENARIO_LOCATION_CONFIG
+from simlib import setUpSimulation
+from simulationmanager import SimulationManager
+from vehicle import Vehicle
+
+FOOTPRINT_OUTPUT_LOCATION = "output/footprint.xml"
+# Scenario 2 tracks every light on a vehicle's route for forcing and biasing
+FOOTPRINT_SCENARIO = 2
+
+
+def measureVehicleFootprint(mapName, vehicles=1000, warmupSteps=600, trafficScale=None):
+    """
+    Measures the Python memory (with tracemalloc) taken by tracking emergency vehicles.
+
+    After warmupSteps of the map's own traffic, an ambulance is added on the route of
+    each running vehicle in turn until there are the given number of them, and all of
+    them are registered with a SimulationManager, sharing light programs and routes.
+    They are then registered again as Vehicles that share nothing, for comparison. Both
+    report the bytes per tracked vehicle over all of them, the marginal bytes of the
+    second half (without the memory shared with the first half) and the bytes by file.
+    """
+    scenarioLocationConfig, scenarioNumberConfig = getScenarioConfigs(mapName, FOOTPRINT_SCENARIO)
+    currPath = __file__.replace("\\", "/")
+    mainProjectDirectory = "/".join(currPath.split("/")[: currPath.split("/").index("src")])
+    mapName = scenarioLocationConfig.mapName + scenarioNumberConfig.nameModifier
+    setUpSimulation(
+        "{0}/maps/{1}/{1}.sumocfg".format(mainProjectDirectory, mapName),
+        trafficScale or scenarioLocationConfig.defaultTrafficScale,
+        "{0}/{1}".format(mainProjectDirectory, FOOTPRINT_OUTPUT_LOCATION),
+        scenarioNumberConfig.level,
+        gui=False,
+    )
+    for _ in range(warmupSteps):
+        traci.simulationStep()
+    routes = [traci.vehicle.getRoute(vehicle_id) for vehicle_id in traci.vehicle.getIDList()]
+    if not routes:
+        raise ValueError("No vehicles are running on %s after %s steps" % (mapName, warmupSteps))
+    vehicle_ids = []
+    for i in range(vehicles):
+        vehicle_id = "footprint_%s" % i
+        traci.route.add("%s_route" % vehicle_id, routes[i % len(routes)])
+        traci.vehicle.add(vehID=vehicle_id, routeID="%s_route" % vehicle_id, typeID="ambulance")
+        vehicle_ids.append(vehicle_id)
+
+    manager = SimulationManager(
+        level=scenarioNumberConfig.level,
+        force_threshold=scenarioLocationConfig.forceThreshold,
+        bias_threshold=scenarioLocationConfig.biasThreshold,
+        bias_multiplier=scenarioLocationConfig.biasMultiplier,
+    )
+    shared = _measure(manager.registerEmergencyVehicle, vehicle_ids)
+    # Without a network to share, each vehicle keeps its own copy of the programs of the
+    # lights on its route and of its route's data, as every vehicle did before sharing
+    unsharedVehicles = {}
+
+    def registerUnshared(vehicle_id):
+        unsharedVehicles[vehicle_id] = Vehicle(vehicle_id, manager.bias_mode)
+
+    unshared = _measure(registerUnshared, vehicle_ids)
+    traci.close()
+
+    return {
+        "vehicles": vehicles,
+        "distinctRoutes": len(set(routes[i % len(routes)] for i in range(vehicles))),
+        "trafficLightsTracked": sum(
+            len(emergency_vehicle._traffic_lights_on_route)
+            for emergency_vehicle in manager.emergency_vehicles.values()
+        ),
+        "shared": shared,
+        "unshared": unshared,
+    }
+
+
+def _measure(register, vehicle_ids):
+    """Registers the vehicles, measuring the memory they take with tracemalloc"""
+    half = len(vehicle_ids) // 2
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for vehicle_id in vehicle_ids[:half]:
+        register(vehicle_id)
+    gc.collect()
+    halfMemory = tracemalloc.get_traced_memory()[0]
+    for vehicle_id in vehicle_ids[half:]:
+        register(vehicle_id)
+    registerTime = time.perf_counter() - started
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    byFile = tracemalloc.take_snapshot().statistics("filename")
+    tracemalloc.stop()
+    return {
+        "bytesPerVehicle": memory / len(vehicle_ids),
+        "marginalBytesPerVehicle": (memory - halfMemory) / (len(vehicle_ids) - half),
+        "registerMsPerVehicle": 1000 * registerTime / len(vehicle_ids),
+        "bytesByFile": {stat.traceback[0].filename.split("/")[-1]: stat.size for stat in byFile[:5]},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the memory taken per tracked emergency vehicle"
+    )
+    parser.add_argument("mapName", choices=SCENARIO_LOCATION_CONFIG.keys())
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--warmup-steps", type=int, default=600)
+    parser.add_argument("--scale", type=float, default=None)
+    args = parser.parse_args()
+
+    footprint = measureVehicleFootprint(args.mapName, args.vehicles, args.warmup_steps, args.scale)
+    logging.info("Footprint: %s", footprint)
+    for key in ("vehicles", "distinctRoutes", "trafficLightsTracked"):
+        print("%24s %s" % (key, footprint[key]))
+    print("%24s %12s %12s" % ("", "unshared", "shared"))
+    for key in ("bytesPerVehicle", "marginalBytesPerVehicle", "registerMsPerVehicle"):
+        print("%24s %12.2f %12.2f" % (key, footprint["unshared"][key], footprint["shared"][key]))
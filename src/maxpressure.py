@@ -0,0 +1,188 @@
+import logging
+import time
+
+import numpy as np
+import traci
+from traci import constants as tc
+
+from detectors import queueDetectorID
+
+# Long enough that a held phase never ends on its own between decisions
+HOLD_DURATION = 86400
+
+
+class MaxPressureController:
+    """
+    Network-wide max-pressure signal control.
+
+    Every control interval, the pressure of a link is the queue on its incoming lane minus
+    the queue on its outgoing lane, and the pressure of a green phase is the sum over the
+    links it serves. Each traffic light then moves to its highest pressure phase, going
+    through the yellow phases of its own program first.
+
+    Queues come from lane area detector subscriptions (see detectors.generateQueueDetectors)
+    and all lights are decided at once with NumPy over a precomputed phase/link incidence
+    list, so TraCI commands are only sent to lights that actually change phase.
+    """
+
+    def __init__(self, interval=5.0, min_green=5.0):
+        self.interval = interval
+        self.min_green = min_green
+        self.decision_times = []
+        self.overdue = False
+        self._next_decision = 0
+        self._pending = {}
+        self._preempted = set()
+
+        lane_index = {}
+
+        def lane(lane_id):
+            return lane_index.setdefault(lane_id, len(lane_index))
+
+        self.traffic_light_ids = []
+        phase_tls, phase_program_index, phase_start = [], [], []
+        pair_phase, pair_in, pair_out = [], [], []
+        self._transitions = {}
+        for traffic_light_id in traci.trafficlight.getIDList():
+            links = traci.trafficlight.getControlledLinks(traffic_light_id)
+            phases = traci.trafficlight.getAllProgramLogics(traffic_light_id)[0].getPhases()
+            green_phases = [
+                i for i, phase in enumerate(phases)
+                if "y" not in phase.state.lower() and any(c in "Gg" for c in phase.state)
+            ]
+            if len(green_phases) < 2:
+                # Nothing to decide between
+                continue
+            tls = len(self.traffic_light_ids)
+            self.traffic_light_ids.append(traffic_light_id)
+            phase_start.append(len(phase_tls))
+            for program_index in green_phases:
+                phase = len(phase_tls)
+                phase_tls.append(tls)
+                phase_program_index.append(program_index)
+                for link_index, state in enumerate(phases[program_index].state):
+                    if state in "Gg" and link_index < len(links):
+                        for in_lane, out_lane, _ in links[link_index]:
+                            pair_phase.append(phase)
+                            pair_in.append(lane(in_lane))
+                            pair_out.append(lane(out_lane))
+                # The transitional (yellow/red) phases the program runs after this one, and
+                # what is left of them from each of those phases
+                transition = []
+                next_index = (program_index + 1) % len(phases)
+                while next_index not in green_phases:
+                    transition.append((next_index, phases[next_index].duration))
+                    next_index = (next_index + 1) % len(phases)
+                self._transitions[(tls, program_index)] = transition
+                for i, (transition_index, _) in enumerate(transition):
+                    self._transitions[(tls, transition_index)] = transition[i:]
+
+        self._tls_index = {traffic_light_id: tls for tls, traffic_light_id in enumerate(self.traffic_light_ids)}
+        self.phase_tls = np.array(phase_tls, dtype=np.int32)
+        self.phase_program_index = np.array(phase_program_index, dtype=np.int32)
+        self.phase_start = np.array(phase_start, dtype=np.int32)
+        self.pair_phase = np.array(pair_phase, dtype=np.int32)
+        self.pair_in = np.array(pair_in, dtype=np.int32)
+        self.pair_out = np.array(pair_out, dtype=np.int32)
+        self.current_phase = np.full(len(self.traffic_light_ids), -1, dtype=np.int32)
+        self.last_switch = np.zeros(len(self.traffic_light_ids))
+
+        self.detector_ids = [queueDetectorID(lane_id) for lane_id in lane_index]
+        for detector_id in self.detector_ids:
+            traci.lanearea.subscribe(detector_id, [tc.LAST_STEP_VEHICLE_NUMBER])
+        logging.info(
+            "Max-pressure control over %s traffic lights, %s phases and %s lanes",
+            len(self.traffic_light_ids),
+            len(phase_tls),
+            len(lane_index),
+        )
+
+    def restoreSubscriptions(self):
+        for detector_id in self.detector_ids:
+            traci.lanearea.subscribe(detector_id, [tc.LAST_STEP_VEHICLE_NUMBER])
+
+    def step(self, now, preempted_traffic_light_ids=(), decide=True):
+        """
+        Finishes any yellow transitions that are due and, once per control interval,
+        decides the phase of every light not currently preempted by an emergency vehicle.
+        decide=False puts a due decision off to the next step.
+        """
+        for tls in [t for t, (_, switch_time) in self._pending.items() if switch_time <= now]:
+            program_index, _ = self._pending.pop(tls)
+            traffic_light_id = self.traffic_light_ids[tls]
+            if traffic_light_id not in preempted_traffic_light_ids:
+                traci.trafficlight.setPhase(traffic_light_id, program_index)
+                traci.trafficlight.setPhaseDuration(traffic_light_id, HOLD_DURATION)
+
+        # Lights released by preemption were left wherever clearing put them
+        released = self._preempted - set(preempted_traffic_light_ids)
+        self._preempted = set(preempted_traffic_light_ids)
+        for traffic_light_id in released:
+            tls = self._tls_index.get(traffic_light_id)
+            if tls is not None:
+                self.current_phase[tls] = -1
+                self.last_switch[tls] = now
+
+        if now < self._next_decision:
+            return
+        self.overdue = not decide
+        if not decide:
+            return
+        self._next_decision = now + self.interval
+
+        started = time.perf_counter()
+        chosen = self.decide(self.readQueues())
+        self.decision_times.append(time.perf_counter() - started)
+
+        switch = (
+            (chosen != self.current_phase)
+            & (now - self.last_switch >= self.min_green)
+        )
+        for tls in np.flatnonzero(switch):
+            traffic_light_id = self.traffic_light_ids[tls]
+            if traffic_light_id in self._preempted or tls in self._pending:
+                continue
+            self._switch(tls, traffic_light_id, self.current_phase[tls], chosen[tls], now)
+
+    def readQueues(self):
+        results = traci.lanearea.getAllSubscriptionResults()
+        return np.fromiter(
+            (results[d][tc.LAST_STEP_VEHICLE_NUMBER] for d in self.detector_ids),
+            dtype=float,
+            count=len(self.detector_ids),
+        )
+
+    def decide(self, queues):
+        """Returns the index (into the green phases) of the highest pressure phase of every light"""
+        link_pressure = queues[self.pair_in] - queues[self.pair_out]
+        phase_pressure = np.bincount(self.pair_phase, weights=link_pressure, minlength=len(self.phase_tls))
+        best = np.maximum.reduceat(phase_pressure, self.phase_start)
+        candidates = np.flatnonzero(phase_pressure == best[self.phase_tls])
+        # Ties go to the first phase of the light
+        _, first = np.unique(self.phase_tls[candidates], return_index=True)
+        return candidates[first]
+
+    def _switch(self, tls, traffic_light_id, current, target, now):
+        program_index = self.phase_program_index[target]
+        self.current_phase[tls] = target
+        self.last_switch[tls] = now
+        if current >= 0:
+            live_phase = self.phase_program_index[current]
+        else:
+            # Not switched by us yet, or just released from preemption, so start from
+            # whichever phase its program is on
+            live_phase = traci.trafficlight.getPhase(traffic_light_id)
+        transition = self._transitions.get((tls, live_phase), []) if live_phase != program_index else []
+        if not transition:
+            traci.trafficlight.setPhase(traffic_light_id, program_index)
+            traci.trafficlight.setPhaseDuration(traffic_light_id, HOLD_DURATION)
+            return
+        # Let the program run its own yellow phases before the chosen phase
+        if transition[0][0] == live_phase:
+            # Already part way through them
+            switch_time = traci.trafficlight.getNextSwitch(traffic_light_id)
+            transition = transition[1:]
+        else:
+            traci.trafficlight.setPhase(traffic_light_id, transition[0][0])
+            switch_time = now
+        self._pending[tls] = (program_index, switch_time + sum(duration for _, duration in transition))
@@ -0,0 +1,691 @@
+import logging
+import math
+import xml.etree.ElementTree as ET
+from collections import deque
+
+import numpy as np
+import sumolib
+import traci
+from traci import constants as tc
+from traci._simulation import Stage
+from traci._trafficlight import Logic, Phase
+
+from simlib import getConfigFiles
+
+# Flow over the stop line of one lane when a movement is open (1800 veh/h)
+SATURATION_FLOW = 0.5
+# Space taken up by a stopped vehicle, used for the storage capacity of an edge
+JAM_SPACING = 7.5
+# SUMO's defaults for the vehicle classes used by the maps
+DEFAULT_MAX_SPEEDS = {"emergency": 44.44, "passenger": 55.56}
+DEFAULT_SPEED_FACTORS = {"emergency": 1.5}
+ONLINE_PROGRAM = "online"
+PENDING = 0
+RUNNING = 1
+ARRIVED = 2
+
+# The parts of the traci module swapped out while the simulator is running
+_TRACI_ATTRIBUTES = ("vehicle", "lane", "trafficlight", "simulation", "route", "simulationStep", "close")
+
+
+class MesoSim:
+    """
+    A queue-based mesoscopic stand-in for SUMO, meant as a quick first filter when
+    sweeping controller variants before confirming them with full SUMO runs.
+
+    Each edge is a FIFO queue per outgoing movement: a vehicle crosses the edge at its
+    free-flow speed, then waits until its movement is open (a green link of the traffic
+    light controlling it, or always if uncontrolled), the movement has discharge
+    capacity left (SATURATION_FLOW per lane) and the next edge has storage left. All
+    vehicles are advanced together with NumPy operations every step.
+
+    start() swaps the parts of the traci module that the SimulationManager, Vehicle,
+    TrafficLight and runScenario use for this simulator, so the controllers run
+    unchanged. close() writes a tripinfo output and restores traci. Detectors (scenarios
+    6 and 7) and saving state are not simulated, so runScenario refuses those with meso.
+    """
+
+    def __init__(self, configFile, trafficScale=1, stepLength=0.1, tripinfoOutput=None, seed=42):
+        self.stepLength = stepLength
+        self.tripinfoOutput = tripinfoOutput
+        self.rng = np.random.default_rng(seed)
+        self.time = 0.0
+        self._originals = {}
+        self._departed = []
+        self._arrived = []
+        self._idList = None
+        self._routes = {}
+        self._shortestPaths = {}
+
+        self._net = sumolib.net.readNet(getConfigFiles(configFile, "net-file")[0], withPrograms=True)
+        self._buildEdges()
+        self._buildMovements()
+        self._buildTrafficLights()
+
+        self.vTypes = {"DEFAULT_VEHTYPE": ("passenger", DEFAULT_MAX_SPEEDS["passenger"], 1.0)}
+        demand = []
+        for routeFile in getConfigFiles(configFile, "route-files"):
+            demand.extend(self._readDemand(routeFile, trafficScale))
+        demand.sort(key=lambda d: d[0])
+        self._allocateVehicles(len(demand) + 64)
+        for depart, vehicleId, typeId, edges in demand:
+            self._addVehicle(vehicleId, typeId, edges, depart, flush=False)
+        self._flushRoutes()
+        self._pendingOrder = deque(range(len(demand)))
+        self._due = deque()
+
+        self.vehicle = _VehicleDomain(self)
+        self.lane = _LaneDomain(self)
+        self.trafficlight = _TrafficLightDomain(self)
+        self.simulation = _SimulationDomain(self)
+        self.route = _RouteDomain(self)
+        logging.info(
+            "Mesoscopic simulator loaded %s edges, %s movements, %s traffic lights and %s vehicles",
+            len(self.edgeIDs),
+            len(self.movementFrom),
+            len(self.tlsIDs),
+            len(demand),
+        )
+
+    # -------------------------------------------------------------------------------
+    # Network
+    # -------------------------------------------------------------------------------
+
+    def _buildEdges(self):
+        edges = [e for e in self._net.getEdges() if e.getFunction() != "internal"]
+        self.edgeIDs = [e.getID() for e in edges]
+        self.edgeIndex = {edgeId: i for i, edgeId in enumerate(self.edgeIDs)}
+        self.edgeLength = np.array([e.getLength() for e in edges])
+        self.edgeSpeed = np.array([e.getSpeed() for e in edges])
+        self.edgeStorage = np.array(
+            [max(1, int(e.getLength() * e.getLaneNumber() / JAM_SPACING)) for e in edges]
+        )
+        self.laneLength = {}
+        self.laneSpeed = {}
+        for e in edges:
+            for lane in e.getLanes():
+                self.laneLength[lane.getID()] = lane.getLength()
+                self.laneSpeed[lane.getID()] = lane.getSpeed()
+
+    def _buildMovements(self):
+        """
+        A movement is an edge to edge pair (or an edge to nowhere for vehicles arriving),
+        discharging over the lanes that connect the two edges
+        """
+        self.movementIndex = {}
+        movementFrom, movementTo, movementLanes, movementLane = [], [], [], []
+        slots = []
+        for edgeId in self.edgeIDs:
+            edge = self._net.getEdge(edgeId)
+            self.movementIndex[(edgeId, None)] = len(movementFrom)
+            movementFrom.append(self.edgeIndex[edgeId])
+            movementTo.append(-1)
+            movementLanes.append(edge.getLaneNumber())
+            movementLane.append(edge.getLanes()[0].getID())
+            for toEdge, connections in edge.getOutgoing().items():
+                if toEdge.getID() not in self.edgeIndex:
+                    continue
+                movement = len(movementFrom)
+                self.movementIndex[(edgeId, toEdge.getID())] = movement
+                movementFrom.append(self.edgeIndex[edgeId])
+                movementTo.append(self.edgeIndex[toEdge.getID()])
+                fromLanes = sorted({c.getFromLane().getIndex() for c in connections})
+                movementLanes.append(len(fromLanes))
+                movementLane.append("%s_%s" % (edgeId, fromLanes[0]))
+                for connection in connections:
+                    if connection.getTLSID():
+                        slots.append((movement, connection.getTLSID(), connection.getTLLinkIndex()))
+        self.movementFrom = np.array(movementFrom, dtype=np.int32)
+        self.movementTo = np.array(movementTo, dtype=np.int32)
+        self.movementRate = np.array(movementLanes, dtype=float) * SATURATION_FLOW
+        self.movementCap = np.array(movementLanes, dtype=float)
+        self.movementLane = movementLane
+        self.movementCredits = np.zeros(len(movementFrom))
+        self._slots = slots
+
+    def _buildTrafficLights(self):
+        trafficLights = self._net.getTrafficLights()
+        self.tlsIDs = [t.getID() for t in trafficLights]
+        self.tlsIndex = {tlsId: i for i, tlsId in enumerate(self.tlsIDs)}
+        self.tlsLinks = []
+        self.tlsPrograms = []
+        self.tlsProgram = []
+        self.tlsPhase = np.zeros(len(trafficLights), dtype=np.int32)
+        self.tlsNextSwitch = np.zeros(len(trafficLights))
+        self.tlsOffset = np.zeros(len(trafficLights), dtype=np.int32)
+        offset = 0
+        for i, trafficLight in enumerate(trafficLights):
+            connections = trafficLight.getConnections()
+            programs = {}
+            for programId, program in trafficLight.getPrograms().items():
+                programs[programId] = Logic(
+                    programID=programId,
+                    type=0,
+                    currentPhaseIndex=0,
+                    phases=[Phase(duration=p.duration, state=p.state) for p in program.getPhases()],
+                )
+            # States can be longer than the highest link index in use
+            linkCount = max(
+                [c[2] + 1 for c in connections]
+                + [len(phase.state) for logic in programs.values() for phase in logic.phases]
+            )
+            links = [[] for _ in range(linkCount)]
+            for inLane, outLane, linkIndex in connections:
+                links[linkIndex].append((inLane.getID(), outLane.getID(), ""))
+            self.tlsLinks.append(links)
+            self.tlsOffset[i] = offset
+            offset += linkCount
+            self.tlsPrograms.append(programs)
+            self.tlsProgram.append(sorted(programs)[0])
+        self.slotGreen = np.zeros(offset, dtype=bool)
+        self.slotMovement = np.array([s[0] for s in self._slots], dtype=np.int32)
+        self.slotIndex = np.array(
+            [self.tlsOffset[self.tlsIndex[s[1]]] + s[2] for s in self._slots], dtype=np.int32
+        )
+        self.movementControlled = np.zeros(len(self.movementFrom), dtype=bool)
+        self.movementControlled[self.slotMovement] = True
+        for i in range(len(self.tlsIDs)):
+            self._setPhase(i, 0)
+
+    def _logic(self, tls):
+        return self.tlsPrograms[tls][self.tlsProgram[tls]]
+
+    def _setPhase(self, tls, phaseIndex, duration=None):
+        phase = self._logic(tls).phases[phaseIndex]
+        self.tlsPhase[tls] = phaseIndex
+        self.tlsNextSwitch[tls] = self.time + (phase.duration if duration is None else duration)
+        self._setState(tls, phase.state)
+
+    def _setState(self, tls, state):
+        offset = self.tlsOffset[tls]
+        self.slotGreen[offset:offset + len(state)] = [c in "Gg" for c in state]
+
+    # -------------------------------------------------------------------------------
+    # Demand
+    # -------------------------------------------------------------------------------
+
+    def _readDemand(self, routeFile, trafficScale):
+        """Expands the vehicles, trips and flows of a route file into (depart, id, type, edges)"""
+        demand = []
+        namedRoutes = {}
+        root = ET.parse(routeFile).getroot()
+        for vType in root.iter("vType"):
+            vClass = vType.get("vClass", "passenger")
+            self.vTypes[vType.get("id")] = (
+                vClass,
+                float(vType.get("maxSpeed", DEFAULT_MAX_SPEEDS.get(vClass, DEFAULT_MAX_SPEEDS["passenger"]))),
+                float(vType.get("speedFactor", DEFAULT_SPEED_FACTORS.get(vClass, 1.0))),
+            )
+        for route in root.findall("route"):
+            namedRoutes[route.get("id")] = route.get("edges").split()
+
+        def routeOf(element):
+            if element.get("route"):
+                return namedRoutes[element.get("route")]
+            nested = element.find("route")
+            if nested is not None:
+                return nested.get("edges").split()
+            edges = [element.get("from")] + element.get("via", "").split() + [element.get("to")]
+            return self._completeRoute(edges)
+
+        def scaled(depart, vehicleId, typeId, edges):
+            copies = int(trafficScale) + (self.rng.random() < trafficScale - int(trafficScale))
+            for copy in range(copies):
+                demand.append((depart, vehicleId if copy == 0 else "%s.scaled%s" % (vehicleId, copy), typeId, edges))
+
+        for element in root:
+            typeId = element.get("type", "DEFAULT_VEHTYPE")
+            if element.tag in ("vehicle", "trip"):
+                scaled(float(element.get("depart")), element.get("id"), typeId, routeOf(element))
+            elif element.tag == "flow":
+                edges = routeOf(element)
+                begin = float(element.get("begin", 0))
+                end = float(element.get("end", 3600))
+                if element.get("vehsPerHour") or element.get("period"):
+                    period = float(element.get("period") or 3600 / float(element.get("vehsPerHour")))
+                    departs = np.arange(begin, end, period)
+                elif element.get("probability"):
+                    seconds = np.arange(begin, end, 1.0)
+                    departs = seconds[self.rng.random(len(seconds)) < float(element.get("probability"))]
+                else:
+                    departs = np.linspace(begin, end, int(element.get("number")), endpoint=False)
+                for i, depart in enumerate(departs):
+                    scaled(float(depart), "%s.%s" % (element.get("id"), i), typeId, edges)
+        return demand
+
+    def _completeRoute(self, edges):
+        """Fills the gaps between consecutive edges that are not directly connected"""
+        route = [edges[0]]
+        for edgeId in edges[1:]:
+            if (route[-1], edgeId) in self.movementIndex:
+                route.append(edgeId)
+                continue
+            key = (route[-1], edgeId)
+            if key not in self._shortestPaths:
+                path, _ = self._net.getShortestPath(self._net.getEdge(route[-1]), self._net.getEdge(edgeId))
+                if path is None:
+                    raise ValueError("No route from %s to %s" % key)
+                self._shortestPaths[key] = [e.getID() for e in path]
+            route.extend(self._shortestPaths[key][1:])
+        return route
+
+    # -------------------------------------------------------------------------------
+    # Vehicles
+    # -------------------------------------------------------------------------------
+
+    def _allocateVehicles(self, size):
+        self.vehicleIDs = []
+        self.vehicleTypes = []
+        self.vehicleIndex = {}
+        self.status = np.full(size, PENDING, dtype=np.int8)
+        self.edge = np.zeros(size, dtype=np.int32)
+        self.routeIndex = np.zeros(size, dtype=np.int32)
+        self.routeOffset = np.zeros(size, dtype=np.int32)
+        self.routeLength = np.zeros(size, dtype=np.int32)
+        self.maxSpeed = np.zeros(size)
+        self.speedFactor = np.ones(size)
+        self.speed = np.zeros(size)
+        self.entry = np.zeros(size)
+        self.ready = np.zeros(size)
+        self.odometer = np.zeros(size)
+        self.depart = np.zeros(size)
+        self.departed = np.zeros(size)
+        self.arrival = np.zeros(size)
+        self.waiting = np.zeros(size)
+        self.routeEdges = np.zeros(0, dtype=np.int32)
+        self.routeMoves = np.zeros(0, dtype=np.int32)
+        self._newRouteEdges = []
+        self._newRouteMoves = []
+        self._routeTotal = 0
+
+    def _growVehicles(self):
+        size = len(self.status)
+        for name in (
+            "status", "edge", "routeIndex", "routeOffset", "routeLength", "maxSpeed", "speedFactor",
+            "speed", "entry", "ready", "odometer", "depart", "departed", "arrival", "waiting",
+        ):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros(size, dtype=array.dtype)]))
+        self.speedFactor[size:] = 1
+
+    def _flushRoutes(self):
+        """Appends the routes of newly added vehicles to the flat route arrays in one go"""
+        if self._newRouteEdges:
+            self.routeEdges = np.concatenate([self.routeEdges] + self._newRouteEdges)
+            self.routeMoves = np.concatenate([self.routeMoves] + self._newRouteMoves)
+            self._newRouteEdges = []
+            self._newRouteMoves = []
+
+    def _addVehicle(self, vehicleId, typeId, edges, depart, flush=True):
+        if vehicleId in self.vehicleIndex:
+            raise traci.TraCIException("The vehicle '%s' to add already exists." % vehicleId)
+        v = len(self.vehicleIDs)
+        if v >= len(self.status):
+            self._growVehicles()
+        vClass, maxSpeed, speedFactor = self.vTypes.get(typeId, self.vTypes["DEFAULT_VEHTYPE"])
+        edgeIndices = [self.edgeIndex[e] for e in edges]
+        moves = [self.movementIndex[(a, b)] for a, b in zip(edges, edges[1:])]
+        moves.append(self.movementIndex[(edges[-1], None)])
+        self.vehicleIDs.append(vehicleId)
+        self.vehicleTypes.append(typeId)
+        self.vehicleIndex[vehicleId] = v
+        self.routeOffset[v] = self._routeTotal
+        self.routeLength[v] = len(edges)
+        self._routeTotal += len(edges)
+        self._newRouteEdges.append(np.array(edgeIndices, dtype=np.int32))
+        self._newRouteMoves.append(np.array(moves, dtype=np.int32))
+        if flush:
+            self._flushRoutes()
+        self.maxSpeed[v] = maxSpeed
+        self.speedFactor[v] = speedFactor
+        self.depart[v] = depart
+        self.edge[v] = edgeIndices[0]
+        return v
+
+    def _insert(self, now, occupancy):
+        """Inserts the vehicles that are due and have space on their first edge"""
+        while self._pendingOrder and self.depart[self._pendingOrder[0]] <= now:
+            self._due.append(self._pendingOrder.popleft())
+        blocked = deque()
+        while self._due:
+            v = self._due.popleft()
+            edge = self.edge[v]
+            if occupancy[edge] >= self.edgeStorage[edge]:
+                blocked.append(v)
+                continue
+            occupancy[edge] += 1
+            self.status[v] = RUNNING
+            self.departed[v] = now
+            self._enterEdge(np.array([v]), now)
+            self._departed.append(self.vehicleIDs[v])
+        self._due = blocked
+
+    def _enterEdge(self, vehicles, now):
+        edges = self.edge[vehicles]
+        self.entry[vehicles] = now
+        self.speed[vehicles] = np.minimum(
+            self.maxSpeed[vehicles] * self.speedFactor[vehicles], self.edgeSpeed[edges]
+        )
+        self.ready[vehicles] = now + self.edgeLength[edges] / self.speed[vehicles]
+
+    # -------------------------------------------------------------------------------
+    # Stepping
+    # -------------------------------------------------------------------------------
+
+    def step(self):
+        now = self.time + self.stepLength
+        self._departed = []
+        self._arrived = []
+        self._idList = None
+
+        # Traffic lights whose phase has ended move on to their next phase
+        for tls in np.flatnonzero(self.tlsNextSwitch <= now):
+            if self.tlsProgram[tls] == ONLINE_PROGRAM:
+                self.tlsNextSwitch[tls] = math.inf
+                continue
+            self.time = self.tlsNextSwitch[tls]
+            self._setPhase(tls, (self.tlsPhase[tls] + 1) % len(self._logic(tls).phases))
+        self.time = now
+
+        # A movement is open if any of its links is green (or it is not controlled at all)
+        isOpen = ~self.movementControlled
+        isOpen[self.slotMovement[self.slotGreen[self.slotIndex]]] = True
+        self.movementCredits = np.where(
+            isOpen, np.minimum(self.movementCredits + self.movementRate * self.stepLength, self.movementCap), 0
+        )
+
+        running = self.status == RUNNING
+        occupancy = np.bincount(self.edge[running], minlength=len(self.edgeIDs))
+
+        queued = np.flatnonzero(running & (self.ready <= now))
+        if len(queued):
+            moves = self.routeMoves[self.routeOffset[queued] + self.routeIndex[queued]]
+            order = np.lexsort((self.ready[queued], moves))
+            queued = queued[order]
+            moves = moves[order]
+            # Position of every vehicle within its movement's queue
+            starts = np.flatnonzero(np.r_[True, moves[1:] != moves[:-1]])
+            rank = np.arange(len(moves)) - np.repeat(starts, np.diff(np.r_[starts, len(moves)]))
+            targets = self.movementTo[moves]
+            hasSpace = (targets < 0) | (occupancy[np.maximum(targets, 0)] < self.edgeStorage[np.maximum(targets, 0)])
+            canGo = isOpen[moves] & hasSpace & (rank < np.floor(self.movementCredits[moves]))
+            # First in, first out: one blocked vehicle holds up everyone behind it
+            blocked = np.cumsum(~canGo)
+            blocked -= np.repeat(blocked[starts] - (~canGo[starts]), np.diff(np.r_[starts, len(moves)]))
+            go = blocked == 0
+            self.movementCredits -= np.bincount(moves[go], minlength=len(self.movementFrom))
+
+            leaving = queued[go]
+            self.waiting[leaving] += now - self.ready[leaving]
+            self.odometer[leaving] += self.edgeLength[self.edge[leaving]]
+            arriving = targets[go] < 0
+            for v in leaving[arriving]:
+                self._arrived.append(self.vehicleIDs[v])
+            self.status[leaving[arriving]] = ARRIVED
+            self.arrival[leaving[arriving]] = now
+            moving = leaving[~arriving]
+            self.routeIndex[moving] += 1
+            self.edge[moving] = targets[go][~arriving]
+            self._enterEdge(moving, now)
+            occupancy = np.bincount(self.edge[self.status == RUNNING], minlength=len(self.edgeIDs))
+
+        self._insert(now, occupancy)
+
+    # -------------------------------------------------------------------------------
+    # traci replacement
+    # -------------------------------------------------------------------------------
+
+    def start(self):
+        """Swaps the simulator in for the parts of the traci module the controllers use"""
+        for name in _TRACI_ATTRIBUTES:
+            self._originals[name] = getattr(traci, name)
+        for domain in ("vehicle", "lane", "trafficlight", "simulation", "route"):
+            setattr(traci, domain, getattr(self, domain))
+        traci.simulationStep = lambda step=0.0: self.step()
+        traci.close = self.close
+
+    def close(self, wait=True):
+        for name, original in self._originals.items():
+            setattr(traci, name, original)
+        self._originals = {}
+        if self.tripinfoOutput:
+            self.writeTripinfo(self.tripinfoOutput)
+
+    def writeTripinfo(self, outputFile):
+        """Writes the finished trips in the same form as SUMO's tripinfo output"""
+        root = ET.Element("tripinfos")
+        for v in np.flatnonzero(self.status == ARRIVED):
+            duration = self.arrival[v] - self.departed[v]
+            route = self.routeEdges[self.routeOffset[v]:self.routeOffset[v] + self.routeLength[v]]
+            freeFlow = np.sum(
+                self.edgeLength[route]
+                / np.minimum(self.maxSpeed[v] * self.speedFactor[v], self.edgeSpeed[route])
+            )
+            ET.SubElement(
+                root,
+                "tripinfo",
+                id=self.vehicleIDs[v],
+                depart="%.2f" % self.departed[v],
+                departDelay="%.2f" % (self.departed[v] - self.depart[v]),
+                arrival="%.2f" % self.arrival[v],
+                duration="%.2f" % duration,
+                routeLength="%.2f" % self.edgeLength[route].sum(),
+                waitingTime="%.2f" % self.waiting[v],
+                timeLoss="%.2f" % max(duration - freeFlow, 0),
+                vType=self.vehicleTypes[v],
+            )
+        ET.ElementTree(root).write(outputFile)
+
+
+class _Domain:
+    def __init__(self, sim):
+        self._sim = sim
+
+    def _completeRoute(self, edges):
+        """Completes a route like MesoSim._completeRoute, failing as TraCI does for bad edges"""
+        sim = self._sim
+        if not edges:
+            raise traci.TraCIException("Route is empty.")
+        for edgeID in edges:
+            if edgeID not in sim.edgeIndex:
+                raise traci.TraCIException("Unknown edge '%s'." % edgeID)
+        try:
+            return sim._completeRoute(list(edges))
+        except ValueError as e:
+            raise traci.TraCIException(str(e))
+
+
+class _VehicleDomain(_Domain):
+    def _index(self, vehID):
+        v = self._sim.vehicleIndex.get(vehID)
+        if v is None or self._sim.status[v] != RUNNING:
+            raise traci.TraCIException("Vehicle '%s' is not known." % vehID)
+        return v
+
+    def getIDList(self):
+        sim = self._sim
+        if sim._idList is None:
+            sim._idList = tuple(sim.vehicleIDs[v] for v in np.flatnonzero(sim.status == RUNNING))
+        return sim._idList
+
+    def getIDCount(self):
+        return int(np.count_nonzero(self._sim.status == RUNNING))
+
+    def getTypeID(self, vehID):
+        return self._sim.vehicleTypes[self._index(vehID)]
+
+    def getRoute(self, vehID):
+        sim = self._sim
+        v = sim.vehicleIndex[vehID]
+        route = sim.routeEdges[sim.routeOffset[v]:sim.routeOffset[v] + sim.routeLength[v]]
+        return tuple(sim.edgeIDs[e] for e in route)
+
+    def getRouteIndex(self, vehID):
+        return int(self._sim.routeIndex[self._index(vehID)])
+
+    def getRoadID(self, vehID):
+        return self._sim.edgeIDs[self._sim.edge[self._index(vehID)]]
+
+    def getLaneID(self, vehID):
+        sim = self._sim
+        v = self._index(vehID)
+        return sim.movementLane[sim.routeMoves[sim.routeOffset[v] + sim.routeIndex[v]]]
+
+    def getLanePosition(self, vehID):
+        sim = self._sim
+        v = self._index(vehID)
+        return float(min((sim.time - sim.entry[v]) * sim.speed[v], sim.edgeLength[sim.edge[v]]))
+
+    def getDistance(self, vehID):
+        return float(self._sim.odometer[self._index(vehID)] + self.getLanePosition(vehID))
+
+    def getSpeed(self, vehID):
+        sim = self._sim
+        v = self._index(vehID)
+        return 0.0 if sim.ready[v] <= sim.time else float(sim.speed[v])
+
+    def getMaxSpeed(self, vehID):
+        return float(self._sim.maxSpeed[self._sim.vehicleIndex[vehID]])
+
+    def getSpeedFactor(self, vehID):
+        return float(self._sim.speedFactor[self._sim.vehicleIndex[vehID]])
+
+    def add(self, vehID, routeID, typeID="DEFAULT_VEHTYPE", depart="now", **kwargs):
+        sim = self._sim
+        departTime = sim.time if depart in ("now", None) else float(depart)
+        v = sim._addVehicle(vehID, typeID, sim._routes[routeID], departTime)
+        sim._due.append(v)
+
+    def setLaneChangeMode(self, vehID, laneChangeMode):
+        # Vehicles do not change lanes in the mesoscopic model
+        pass
+
+    def setParameter(self, vehID, key, value):
+        pass
+
+
+class _LaneDomain(_Domain):
+    def getLength(self, laneID):
+        return self._sim.laneLength[laneID]
+
+    def getMaxSpeed(self, laneID):
+        return self._sim.laneSpeed[laneID]
+
+
+class _TrafficLightDomain(_Domain):
+    def _index(self, tlsID):
+        return self._sim.tlsIndex[tlsID]
+
+    def getIDList(self):
+        return tuple(self._sim.tlsIDs)
+
+    def getControlledLinks(self, tlsID):
+        return self._sim.tlsLinks[self._index(tlsID)]
+
+    def getAllProgramLogics(self, tlsID):
+        sim = self._sim
+        tls = self._index(tlsID)
+        current = sim.tlsProgram[tls]
+        logics = [sim.tlsPrograms[tls][current]]
+        logics[0].currentPhaseIndex = int(sim.tlsPhase[tls])
+        logics.extend(logic for programId, logic in sim.tlsPrograms[tls].items() if programId != current)
+        return logics
+
+    def getProgram(self, tlsID):
+        return self._sim.tlsProgram[self._index(tlsID)]
+
+    def getPhase(self, tlsID):
+        return int(self._sim.tlsPhase[self._index(tlsID)])
+
+    def getNextSwitch(self, tlsID):
+        return float(self._sim.tlsNextSwitch[self._index(tlsID)])
+
+    def getRedYellowGreenState(self, tlsID):
+        sim = self._sim
+        tls = self._index(tlsID)
+        return sim._logic(tls).phases[sim.tlsPhase[tls]].state
+
+    def setRedYellowGreenState(self, tlsID, state):
+        sim = self._sim
+        tls = self._index(tlsID)
+        sim.tlsPrograms[tls][ONLINE_PROGRAM] = Logic(
+            programID=ONLINE_PROGRAM,
+            type=0,
+            currentPhaseIndex=0,
+            phases=[Phase(duration=math.inf, state=state)],
+        )
+        sim.tlsProgram[tls] = ONLINE_PROGRAM
+        sim._setPhase(tls, 0)
+
+    def setProgramLogic(self, tlsID, logic):
+        sim = self._sim
+        tls = self._index(tlsID)
+        sim.tlsPrograms[tls][logic.programID] = logic
+        sim.tlsProgram[tls] = logic.programID
+        sim._setPhase(tls, min(logic.currentPhaseIndex, len(logic.phases) - 1))
+
+    def setProgram(self, tlsID, programID):
+        sim = self._sim
+        tls = self._index(tlsID)
+        sim.tlsProgram[tls] = str(programID)
+        sim._setPhase(tls, 0)
+
+    def setPhase(self, tlsID, index):
+        sim = self._sim
+        tls = self._index(tlsID)
+        if not 0 <= index < len(sim._logic(tls).phases):
+            raise traci.TraCIException("The phase index %s is not in the allowed range." % index)
+        sim._setPhase(tls, index)
+
+    def setPhaseDuration(self, tlsID, phaseDuration):
+        sim = self._sim
+        sim.tlsNextSwitch[self._index(tlsID)] = sim.time + phaseDuration
+
+
+class _SimulationDomain(_Domain):
+    _subscribed = ()
+
+    def getTime(self):
+        return round(self._sim.time, 6)
+
+    def getDeltaT(self):
+        return self._sim.stepLength
+
+    def getDepartedIDList(self):
+        return tuple(self._sim._departed)
+
+    def getArrivedIDList(self):
+        return tuple(self._sim._arrived)
+
+    def subscribe(self, varIDs=(tc.VAR_DEPARTED_VEHICLES_IDS,), begin=0, end=2**31 - 1):
+        lists = (tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS)
+        unsupported = [varID for varID in varIDs if varID not in lists]
+        if unsupported:
+            raise traci.TraCIException("Unsupported simulation variables %s" % unsupported)
+        self._subscribed = tuple(varIDs)
+
+    def getSubscriptionResults(self):
+        lists = {
+            tc.VAR_DEPARTED_VEHICLES_IDS: self.getDepartedIDList,
+            tc.VAR_ARRIVED_VEHICLES_IDS: self.getArrivedIDList,
+        }
+        return {varID: lists[varID]() for varID in self._subscribed}
+
+    def findRoute(self, fromEdge, toEdge, vType="", depart=-1.0, routingMode=0):
+        sim = self._sim
+        edges = self._completeRoute([fromEdge, toEdge])
+        indices = [sim.edgeIndex[e] for e in edges]
+        maxSpeed, speedFactor = sim.vTypes.get(vType, sim.vTypes["DEFAULT_VEHTYPE"])[1:]
+        travelTime = np.sum(
+            sim.edgeLength[indices] / np.minimum(maxSpeed * speedFactor, sim.edgeSpeed[indices])
+        )
+        return Stage(edges=edges, travelTime=float(travelTime), length=float(sim.edgeLength[indices].sum()))
+
+    def getMinExpectedNumber(self):
+        sim = self._sim
+        return int(np.count_nonzero(sim.status != ARRIVED))
+
+
+class _RouteDomain(_Domain):
+    def add(self, routeID, edges):
+        self._sim._routes[routeID] = self._completeRoute(list(edges))
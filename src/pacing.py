@@ -0,0 +1,79 @@
+import logging
+import time
+
+import traci
+
+# Share of each step the controllers may spend before optional work is postponed
+DEFAULT_CONTROLLER_BUDGET = 0.5
+
+
+class RealTimePacer:
+    """
+    Paces the runScenario loop to wall-clock time, e.g. for demos or hardware in the loop.
+
+    Every step is given a slot of stepLength / speed seconds on an absolute schedule, so a
+    slow step is made up for by the steps after it instead of shifting the rest of the run.
+    The controllers get a deadline of controllerBudget of the slot, less however far the
+    run has fallen behind: past it, SimulationManager only does its essential work (forcing
+    and clearing) and postpones biasing and max-pressure decisions to later steps.
+    Deadline misses, late steps and the postponed work left over are counted for summary().
+    """
+
+    def __init__(self, speed=1.0, controllerBudget=DEFAULT_CONTROLLER_BUDGET):
+        self.speed = speed
+        self.controllerBudget = controllerBudget
+        self.steps = 0
+        self.deadlineMisses = 0
+        self.lateSteps = 0
+        self.maxLag = 0
+        self.maxBacklog = 0
+        self.backlog = 0
+        self._slot = None
+        self._start = None
+        self._deadline = None
+
+    def start(self):
+        """Starts the schedule, to be called once the simulation has been set up"""
+        self._slot = traci.simulation.getDeltaT() / self.speed
+        self._start = time.perf_counter()
+
+    def startStep(self):
+        """Returns the time.perf_counter() deadline for the controllers of this step"""
+        slotStart = self._start + self.steps * self._slot
+        lag = max(0, time.perf_counter() - slotStart)
+        self._deadline = slotStart + lag + max(0, self.controllerBudget * self._slot - lag)
+        return self._deadline
+
+    def controllersDone(self, backlog=0):
+        """Records whether the controllers kept to their deadline and what they left postponed"""
+        if time.perf_counter() > self._deadline:
+            self.deadlineMisses += 1
+        self.backlog = backlog
+        self.maxBacklog = max(self.maxBacklog, backlog)
+
+    def endStep(self):
+        """Waits for the end of this step's slot"""
+        self.steps += 1
+        remaining = self._start + self.steps * self._slot - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        else:
+            self.lateSteps += 1
+            self.maxLag = max(self.maxLag, -remaining)
+
+    def summary(self):
+        steps = self.steps or 1
+        return {
+            "steps": self.steps,
+            "deadlineMisses": self.deadlineMisses,
+            "lateSteps": self.lateSteps / steps,
+            "maxLagMs": 1000 * self.maxLag,
+            "maxBacklog": self.maxBacklog,
+            "finalBacklog": self.backlog,
+        }
+
+    def logSummary(self):
+        logging.info(
+            "Real-time pacing: %s",
+            "|".join(" %s: %s " % (key, value) for key, value in self.summary().items()),
+        )
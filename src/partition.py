@@ -0,0 +1,593 @@
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import sumolib
+import traci
+from traci import constants as tc
+
+from scenario_manager import (
+    runScenario,
+    getScenarioConfigs,
+    BLUELIGHT_REACTION_DISTANCES,
+    DEFAULT_OUTPUT_SAVE_LOCATION,
+    SCENARIO_LOCATION_CONFIG,
+)
+from simlib import getConfigFiles, setUpSimulation
+from simulationmanager import SimulationManager
+from vehicle import TrafficLightState
+
+PARTITION_LOCATION = "output/partitions/{0}_{1}"
+STEP_LENGTH = 0.1
+# Levels whose controllers only depend on the emergency vehicle's own position
+PARTITIONED_LEVELS = (0, 1, 2, 3, 4)
+# Levels whose partitioned runs agree with the single process run. Preempting lights on
+# these maps gridlocks junctions until SUMO teleports the blocked vehicles, and handing a
+# vehicle over restarts its waiting time, so the other levels do not agree yet
+AGREEING_PARTITIONED_LEVELS = (0,)
+# Seconds between checks that a region worker is still alive while waiting for it
+WORKER_POLL_INTERVAL = 1.0
+
+partitionTuple = namedtuple("partitionTuple", "edgeRegions trafficLightRegions entryEdges")
+handoffTuple = namedtuple(
+    "handoffTuple", "vehicle typeID route lane position speed speedFactor trafficLights"
+)
+
+
+def partitionNetwork(netFile, regions):
+    """
+    Splits a net into regions by recursive coordinate bisection of its junctions, weighted
+    by the length of the lanes leading into each one. An edge belongs to the region of the
+    junction it leads into, so a traffic light shares a region with all of its incoming
+    lanes. A region's entry edges are the other regions' edges leaving its junctions,
+    which is where its vehicles are handed off.
+    """
+    net = sumolib.net.readNet(netFile)
+    nodes = net.getNodes()
+    if regions > len(nodes):
+        raise ValueError("Cannot split %s junctions into %s regions" % (len(nodes), regions))
+    weights = {
+        node.getID(): sum(lane.getLength() for edge in node.getIncoming() for lane in edge.getLanes()) or 1.0
+        for node in nodes
+    }
+    nodeRegions = {}
+    _bisect([(node.getCoord(), node.getID()) for node in nodes], weights, 0, regions, nodeRegions)
+
+    edgeRegions = {}
+    entryEdges = [[] for _ in range(regions)]
+    for edge in net.getEdges():
+        region = nodeRegions[edge.getToNode().getID()]
+        edgeRegions[edge.getID()] = region
+        fromRegion = nodeRegions[edge.getFromNode().getID()]
+        if fromRegion != region:
+            entryEdges[fromRegion].append(edge.getID())
+    trafficLightRegions = {
+        tls.getID(): edgeRegions[tls.getConnections()[0][0].getEdge().getID()]
+        for tls in net.getTrafficLights()
+        if tls.getConnections()
+    }
+    return partitionTuple(edgeRegions, trafficLightRegions, entryEdges)
+
+
+def _bisect(nodes, weights, firstRegion, regions, nodeRegions):
+    if regions == 1:
+        for _, node_id in nodes:
+            nodeRegions[node_id] = firstRegion
+        return
+    xs = [coord[0] for coord, _ in nodes]
+    ys = [coord[1] for coord, _ in nodes]
+    axis = 0 if max(xs) - min(xs) >= max(ys) - min(ys) else 1
+    nodes = sorted(nodes, key=lambda node: node[0][axis])
+
+    lowerRegions = regions // 2
+    target = sum(weights[node_id] for _, node_id in nodes) * lowerRegions / regions
+    total = 0
+    split = 0
+    while split < len(nodes) and total < target:
+        total += weights[nodes[split][1]]
+        split += 1
+    # Leave every region at least one junction
+    split = min(max(split, lowerRegions), len(nodes) - (regions - lowerRegions))
+    _bisect(nodes[:split], weights, firstRegion, lowerRegions, nodeRegions)
+    _bisect(nodes[split:], weights, firstRegion + lowerRegions, regions - lowerRegions, nodeRegions)
+
+
+def splitDemand(routeFiles, edgeRegions, regions, directory):
+    """
+    Writes a route file per region with the vehicles, trips and flows starting in it,
+    along with every vehicle type and named route so any region can take a handoff
+    """
+    shared = []
+    assigned = [[] for _ in range(regions)]
+    routes = {}
+    for routeFile in routeFiles:
+        for element in ET.parse(routeFile).getroot():
+            if element.tag == "route" and element.get("id"):
+                routes[element.get("id")] = element.get("edges", "").split()
+            if element.tag in ("vehicle", "trip", "flow"):
+                firstEdge = _firstEdge(element, routes)
+                if firstEdge not in edgeRegions:
+                    logging.warning("Could not place %s %s in a region", element.tag, element.get("id"))
+                assigned[edgeRegions.get(firstEdge, 0)].append(element)
+            else:
+                shared.append(element)
+
+    os.makedirs(directory, exist_ok=True)
+    routeFiles = []
+    for region, elements in enumerate(assigned):
+        root = ET.Element("routes")
+        root.extend(shared)
+        root.extend(sorted(elements, key=_departTime))
+        routeFile = os.path.join(directory, "routes_%s.rou.xml" % region)
+        ET.ElementTree(root).write(routeFile)
+        routeFiles.append(routeFile)
+    return routeFiles
+
+
+def _firstEdge(element, routes):
+    if element.get("from"):
+        return element.get("from")
+    if element.get("route") in routes:
+        return routes[element.get("route")][0]
+    route = element.find("route")
+    if route is not None and route.get("edges"):
+        return route.get("edges").split()[0]
+    return None
+
+
+def _departTime(element):
+    try:
+        return float(element.get("depart", element.get("begin", 0)))
+    except ValueError:
+        return 0
+
+
+class RegionWorker:
+    """
+    Runs one region in its own process: a SUMO instance with the full net but only the
+    region's demand, and the region's own SimulationManager.
+
+    Each step, vehicles found on the region's entry edges are removed and described in a
+    handoff (remaining route, lane, position and speed, plus the state of every light on
+    an emergency vehicle's route) for the region they have driven into to re-insert.
+    Forcing, biasing and clearing a light owned by another region only changes this
+    region's copy, so every change is also sent as a mirror for the owner to apply.
+    """
+
+    def __init__(
+        self,
+        region,
+        configFile,
+        routeFile,
+        outputFile,
+        trafficScale,
+        level,
+        enableManager,
+        forceThreshold,
+        biasThreshold,
+        biasMultiplier,
+        partition,
+        vehicleParameters=None,
+    ):
+        self.region = region
+        self.configFile = configFile
+        self.routeFile = routeFile
+        self.outputFile = outputFile
+        self.trafficScale = trafficScale
+        self.level = level
+        self.enableManager = enableManager
+        self.forceThreshold = forceThreshold
+        self.biasThreshold = biasThreshold
+        self.biasMultiplier = biasMultiplier
+        self.partition = partition
+        self.vehicleParameters = vehicleParameters or {}
+        self.manager = None
+        self.controllerTime = 0
+        self.sumoTime = 0
+        self._handedIn = set()
+        self._handedOut = set()
+        self._mirrored = {}
+        self._routeNumbers = itertools.count()
+
+    def run(self, connection):
+        setUpSimulation(
+            self.configFile,
+            self.trafficScale,
+            self.outputFile,
+            self.level,
+            gui=False,
+            routeFiles=[self.routeFile],
+        )
+        for edge_id in self.partition.entryEdges[self.region]:
+            traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_ID_LIST])
+        traci.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS])
+        if self.enableManager:
+            self.manager = SimulationManager(
+                level=self.level,
+                force_threshold=self.forceThreshold,
+                bias_threshold=self.biasThreshold,
+                bias_multiplier=self.biasMultiplier,
+            )
+            # Mirrors replace the programs of this region's copies of other regions' lights,
+            # so the original programs the lights are cleared back to are read first
+            self.manager.traffic_light_network.index()
+
+        try:
+            while True:
+                message = connection.recv()
+                if message is None:
+                    break
+                connection.send(self.step(*message))
+        finally:
+            traci.close()
+        connection.send({"controllerTime": self.controllerTime, "sumoTime": self.sumoTime})
+
+    def step(self, injections, handoffs, mirrors):
+        """
+        Applies the mirrors and handoffs from the other regions and runs one step, returning
+        the time, the vehicles that departed or arrived, and the handoffs and mirrors to send
+        """
+        controllerStart = time.perf_counter()
+        for light_id, mirror in mirrors:
+            _applyMirror(light_id, mirror)
+        for handoff in handoffs:
+            self._accept(handoff)
+        for vehicle_id, route in injections:
+            self._inject(vehicle_id, route)
+        if self.manager:
+            self.manager.handleSimulationStep()
+
+        sumoStart = time.perf_counter()
+        traci.simulationStep()
+        sumoEnd = time.perf_counter()
+
+        results = traci.simulation.getSubscriptionResults()
+        departed = []
+        for vehicle_id in results[tc.VAR_DEPARTED_VEHICLES_IDS]:
+            if vehicle_id in self._handedIn:
+                self._handedIn.discard(vehicle_id)
+            else:
+                departed.append(vehicle_id)
+        arrived = []
+        for vehicle_id in results[tc.VAR_ARRIVED_VEHICLES_IDS]:
+            # Removed vehicles are not always reported as arrived, so these are only
+            # forgotten if the vehicle is handed back
+            if vehicle_id not in self._handedOut:
+                arrived.append(vehicle_id)
+
+        outbound = self._handOff()
+        mirrors = self._mirrorTrafficLights()
+        # Only once their lights have been mirrored can the leaving vehicles go
+        for _, handoff in outbound:
+            traci.vehicle.remove(handoff.vehicle)
+            self._handedOut.add(handoff.vehicle)
+            if self.manager:
+                self.manager.emergency_vehicles.pop(handoff.vehicle, None)
+        self.controllerTime += (sumoStart - controllerStart) + (time.perf_counter() - sumoEnd)
+        self.sumoTime += sumoEnd - sumoStart
+        return traci.simulation.getTime(), departed, arrived, outbound, mirrors
+
+    def _inject(self, vehicle_id, route):
+        traci.route.add("%s_route" % vehicle_id, route)
+        traci.vehicle.add(vehID=vehicle_id, routeID="%s_route" % vehicle_id, typeID="ambulance", departSpeed="max")
+        for key, value in self.vehicleParameters.items():
+            traci.vehicle.setParameter(vehicle_id, key, value)
+
+    def _handOff(self):
+        leaving = {}
+        for edge_id, results in traci.edge.getAllSubscriptionResults().items():
+            for vehicle_id in results[tc.LAST_STEP_VEHICLE_ID_LIST]:
+                leaving[vehicle_id] = self.partition.edgeRegions[edge_id]
+
+        outbound = []
+        for vehicle_id, region in leaving.items():
+            trafficLights = None
+            emergency_vehicle = self.manager.emergency_vehicles.get(vehicle_id) if self.manager else None
+            if emergency_vehicle:
+                # Clear the lights it has just passed while it is still here to clear them
+                emergency_vehicle.calculate_traffic_light_distances(
+                    force_threshold=self.forceThreshold,
+                    bias_threshold=self.biasThreshold,
+                    bias_multiplier=self.biasMultiplier,
+                )
+                trafficLights = {
+                    traffic_light.id: traffic_light.status
+                    for traffic_light in emergency_vehicle._traffic_lights_on_route
+                }
+            outbound.append(
+                (
+                    region,
+                    handoffTuple(
+                        vehicle_id,
+                        traci.vehicle.getTypeID(vehicle_id),
+                        traci.vehicle.getRoute(vehicle_id)[traci.vehicle.getRouteIndex(vehicle_id):],
+                        traci.vehicle.getLaneIndex(vehicle_id),
+                        traci.vehicle.getLanePosition(vehicle_id),
+                        traci.vehicle.getSpeed(vehicle_id),
+                        traci.vehicle.getSpeedFactor(vehicle_id),
+                        trafficLights,
+                    ),
+                )
+            )
+        return outbound
+
+    def _accept(self, handoff):
+        vehicle_id = handoff.vehicle
+        route_id = "%s_handoff%s" % (vehicle_id, next(self._routeNumbers))
+        traci.route.add(route_id, handoff.route)
+        traci.vehicle.add(
+            vehID=vehicle_id,
+            routeID=route_id,
+            typeID=handoff.typeID,
+            departLane=str(handoff.lane),
+            departPos=str(handoff.position),
+            departSpeed=str(handoff.speed),
+        )
+        traci.vehicle.setSpeedFactor(vehicle_id, handoff.speedFactor)
+        if handoff.typeID == "ambulance":
+            for key, value in self.vehicleParameters.items():
+                traci.vehicle.setParameter(vehicle_id, key, value)
+        self._handedIn.add(vehicle_id)
+        self._handedOut.discard(vehicle_id)
+
+        if handoff.trafficLights is None or not self.manager:
+            return
+        self.manager.registerEmergencyVehicle(vehicle_id)
+        for traffic_light in self.manager.emergency_vehicles[vehicle_id]._traffic_lights_on_route:
+            if traffic_light.id not in handoff.trafficLights:
+                continue
+            traffic_light.status = handoff.trafficLights[traffic_light.id]
+            if self.partition.trafficLightRegions.get(traffic_light.id, self.region) != self.region:
+                # Its owner already has this state
+                self._mirrored[traffic_light.id] = traffic_light.status
+            if traffic_light.status is TrafficLightState.FORCED:
+                traci.vehicle.setLaneChangeMode(vehicle_id, 0)
+
+    def _mirrorTrafficLights(self):
+        if not self.manager:
+            return []
+        trafficLights = {}
+        for emergency_vehicle in self.manager.emergency_vehicles.values():
+            for traffic_light in emergency_vehicle._traffic_lights_on_route:
+                owner = self.partition.trafficLightRegions.get(traffic_light.id, self.region)
+                if owner != self.region and (
+                    traffic_light.id not in trafficLights or traffic_light.status is not TrafficLightState.NONE
+                ):
+                    trafficLights[traffic_light.id] = (owner, traffic_light)
+
+        mirrors = [
+            (owner, traffic_light.id, _captureTrafficLight(traffic_light))
+            for owner, traffic_light in trafficLights.values()
+            if traffic_light.status is not self._mirrored.get(traffic_light.id, TrafficLightState.NONE)
+        ]
+        self._mirrored = {
+            light_id: traffic_light.status for light_id, (_, traffic_light) in trafficLights.items()
+        }
+        return mirrors
+
+
+def _captureTrafficLight(traffic_light):
+    light_id = traffic_light.id
+    if traffic_light.status is TrafficLightState.FORCED:
+        return (traffic_light.status, traci.trafficlight.getRedYellowGreenState(light_id))
+    if traffic_light.status is TrafficLightState.BIASED:
+        programID = traci.trafficlight.getProgram(light_id)
+        logic = next(
+            logic
+            for logic in traci.trafficlight.getAllProgramLogics(light_id)
+            if logic.programID == programID
+        )
+    else:
+        logic = traffic_light.original_logic
+    return (
+        traffic_light.status,
+        logic,
+        traci.trafficlight.getPhase(light_id),
+        traci.trafficlight.getNextSwitch(light_id) - traci.simulation.getTime(),
+    )
+
+
+def _applyMirror(light_id, mirror):
+    if mirror[0] is TrafficLightState.FORCED:
+        traci.trafficlight.setRedYellowGreenState(light_id, mirror[1])
+        return
+    _, logic, phase, remainingDuration = mirror
+    traci.trafficlight.setProgramLogic(light_id, logic)
+    traci.trafficlight.setProgram(light_id, logic.programID)
+    traci.trafficlight.setPhase(light_id, phase)
+    traci.trafficlight.setPhaseDuration(light_id, remainingDuration)
+
+
+def _runRegion(connection, settings):
+    RegionWorker(**settings).run(connection)
+
+
+def _receive(connection, process):
+    """Waits for a region worker's reply, failing if the worker dies instead of answering"""
+    while not connection.poll(WORKER_POLL_INTERVAL):
+        if not process.is_alive():
+            raise RuntimeError("%s exited with code %s" % (process.name, process.exitcode))
+    try:
+        return connection.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError("%s exited with code %s" % (process.name, process.exitcode))
+
+
+def runPartitioned(mapName, scenarioNum, regions, numOfSteps=20000, trafficScale=None, mainProjectDirectory="."):
+    """
+    Runs a scenario split into regions, each with its own SUMO and controller process,
+    stepping them in lockstep and passing handoffs and mirrored lights between them
+    after every step. Returns the timings and every completed trip (depart, arrival).
+    """
+    scenarioLocationConfig, scenarioNumberConfig = getScenarioConfigs(mapName, scenarioNum)
+    if scenarioNumberConfig.level not in PARTITIONED_LEVELS:
+        raise ValueError(
+            "Scenario %s cannot be partitioned, available numbers: %s" % (scenarioNum, PARTITIONED_LEVELS)
+        )
+    if scenarioNumberConfig.level not in AGREEING_PARTITIONED_LEVELS:
+        logging.warning(
+            "Partitioned runs of scenario %s do not agree with the single process run yet", scenarioNum
+        )
+    baseMapName = scenarioLocationConfig.mapName + scenarioNumberConfig.nameModifier
+    configFile = "{0}/maps/{1}/{1}.sumocfg".format(mainProjectDirectory, baseMapName)
+    directory = "{0}/{1}".format(mainProjectDirectory, PARTITION_LOCATION.format(baseMapName, regions))
+
+    partition = partitionNetwork(getConfigFiles(configFile, "net-file")[0], regions)
+    routeFiles = splitDemand(getConfigFiles(configFile, "route-files"), partition.edgeRegions, regions, directory)
+    vehicleParameters = (
+        {"device.bluelight.reactiondist": BLUELIGHT_REACTION_DISTANCES[scenarioNumberConfig.level]}
+        if scenarioNumberConfig.level in BLUELIGHT_REACTION_DISTANCES
+        else None
+    )
+
+    connections = []
+    processes = []
+    try:
+        for region in range(regions):
+            connection, workerConnection = multiprocessing.Pipe()
+            settings = dict(
+                region=region,
+                configFile=configFile,
+                routeFile=routeFiles[region],
+                outputFile=os.path.join(directory, "tripinfo_%s.xml" % region),
+                trafficScale=trafficScale or scenarioLocationConfig.defaultTrafficScale,
+                level=scenarioNumberConfig.level,
+                enableManager=scenarioNumberConfig.enableManager,
+                forceThreshold=scenarioLocationConfig.forceThreshold,
+                biasThreshold=scenarioLocationConfig.biasThreshold,
+                biasMultiplier=scenarioLocationConfig.biasMultiplier,
+                partition=partition,
+                vehicleParameters=vehicleParameters,
+            )
+            process = multiprocessing.Process(target=_runRegion, args=(workerConnection, settings), name="region-%s" % region)
+            process.start()
+            # Only the worker keeps its end open, so a worker that dies closes the pipe
+            workerConnection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        departures = {}
+        trips = {}
+        handoffs = 0
+        now = 0
+        inbound = [([], [], []) for _ in range(regions)]
+        started = time.perf_counter()
+        for _ in range(numOfSteps):
+            if scenarioLocationConfig.ambulanceStartStep and abs(now - scenarioLocationConfig.ambulanceStartStep) < STEP_LENGTH / 2:
+                inbound[partition.edgeRegions[scenarioLocationConfig.ambulanceStartEdge]][0].append(
+                    ("ambulance", [scenarioLocationConfig.ambulanceStartEdge, scenarioLocationConfig.ambulanceEndEdge])
+                )
+            for connection, message in zip(connections, inbound):
+                connection.send(message)
+            inbound = [([], [], []) for _ in range(regions)]
+            for connection, process in zip(connections, processes):
+                now, departed, arrived, outbound, mirrors = _receive(connection, process)
+                for vehicle_id in departed:
+                    departures[vehicle_id] = now
+                for vehicle_id in arrived:
+                    if vehicle_id in departures:
+                        trips[vehicle_id] = (departures.pop(vehicle_id), now)
+                for region, handoff in outbound:
+                    inbound[region][1].append(handoff)
+                for region, light_id, mirror in mirrors:
+                    inbound[region][2].append((light_id, mirror))
+                handoffs += len(outbound)
+        wallTime = time.perf_counter() - started
+
+        regionStats = []
+        for connection, process in zip(connections, processes):
+            connection.send(None)
+            regionStats.append(_receive(connection, process))
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    return {
+        "regions": regions,
+        "wallTime": wallTime,
+        "stepsPerSecond": numOfSteps / wallTime,
+        "handoffs": handoffs,
+        "sumoTime": max(stats["sumoTime"] for stats in regionStats),
+        "controllerTime": max(stats["controllerTime"] for stats in regionStats),
+        "trips": trips,
+    }
+
+
+def readTrips(tripinfoFile):
+    """Reads the (depart, arrival) of every trip in a tripinfo output"""
+    trips = {}
+    for _, trip in ET.iterparse(tripinfoFile):
+        if trip.tag == "tripinfo":
+            trips[trip.get("id")] = (float(trip.get("depart")), float(trip.get("arrival")))
+        trip.clear()
+    return trips
+
+
+def summariseTrips(trips):
+    durations = [arrival - depart for depart, arrival in trips.values()]
+    ambulance = trips.get("ambulance")
+    return {
+        "arrived": len(trips),
+        "meanTravelTime": sum(durations) / len(durations) if durations else None,
+        "ambulanceTravelTime": ambulance[1] - ambulance[0] if ambulance else None,
+    }
+
+
+def compareTrips(trips, referenceTrips):
+    """How far a partitioned run's trips are from the single process run's"""
+    common = trips.keys() & referenceTrips.keys()
+    differences = [
+        abs((trips[v][1] - trips[v][0]) - (referenceTrips[v][1] - referenceTrips[v][0]))
+        for v in common
+    ]
+    return {
+        "commonTrips": len(common) / len(referenceTrips) if referenceTrips else None,
+        "meanTravelTimeDifference": sum(differences) / len(differences) if differences else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs a scenario split into regions over several processes and checks it against the single process run"
+    )
+    parser.add_argument("mapName", choices=SCENARIO_LOCATION_CONFIG.keys())
+    parser.add_argument("scenarioNum", type=int)
+    parser.add_argument("--regions", type=int, nargs="+", default=[2])
+    parser.add_argument("--steps", type=int, default=20000)
+    parser.add_argument("--scale", type=float, default=None)
+    args = parser.parse_args()
+
+    currPath = __file__.replace("\\", "/")
+    mainProjectDirectory = "/".join(currPath.split("/")[: currPath.split("/").index("src")])
+
+    started = time.perf_counter()
+    runScenario(args.mapName, args.scenarioNum, args.steps, trafficScale=args.scale, gui=False)
+    referenceWallTime = time.perf_counter() - started
+    referenceTrips = readTrips("{0}/{1}".format(mainProjectDirectory, DEFAULT_OUTPUT_SAVE_LOCATION))
+    reference = summariseTrips(referenceTrips)
+
+    print("%8s %10s %10s %9s %9s %10s %10s %8s %12s" % (
+        "regions", "wallTime", "steps/s", "handoffs", "arrived", "meanTrip", "ambulance", "common", "tripDiff"
+    ))
+    print("%8s %10.1f %10.1f %9s %9d %10.1f %10s %8s %12s" % (
+        "single", referenceWallTime, args.steps / referenceWallTime, "-", reference["arrived"],
+        reference["meanTravelTime"] or 0,
+        "%.1f" % reference["ambulanceTravelTime"] if reference["ambulanceTravelTime"] else "-", "-", "-",
+    ))
+    for regions in args.regions:
+        result = runPartitioned(args.mapName, args.scenarioNum, regions, args.steps, args.scale, mainProjectDirectory)
+        summary = summariseTrips(result["trips"])
+        agreement = compareTrips(result["trips"], referenceTrips)
+        print("%8d %10.1f %10.1f %9d %9d %10.1f %10s %8.2f %12.2f" % (
+            regions, result["wallTime"], result["stepsPerSecond"], result["handoffs"], summary["arrived"],
+            summary["meanTravelTime"] or 0,
+            "%.1f" % summary["ambulanceTravelTime"] if summary["ambulanceTravelTime"] else "-",
+            agreement["commonTrips"] or 0, agreement["meanTravelTimeDifference"] or 0,
+        ))
@@ -2,32 +2,48 @@ import logging
 import traci
 import random
 
+NO_LANES = frozenset()
+
 
 class Platoon:
+    __slots__ = (
+        "_vehicles",
+        "_active",
+        "_color",
+        "_currentSpeed",
+        "_disbandReason",
+        "_eligibleForMerging",
+        "_lane",
+        "_lanePosition",
+        "_controlledLanes",
+        "_targetSpeed",
+        "_maxVehicles",
+    )
+
     def __init__(self, startingVehicles, maxVehicles=0):
         """Create a platoon, setting default values for all variables"""
         logging.info("Creating a new platoon with: %s", startingVehicles)
         self._vehicles = list(startingVehicles)
 
         self._active = True
-        self._color = (
-            random.randint(0, 255),
-            random.randint(0, 255),
-            random.randint(0, 255),
-        )
+        # Packed into a single int, see getColor
+        self._color = random.getrandbits(24)
         self._currentSpeed = self.getLeadVehicle().getSpeed()
         self._disbandReason = None
         self._eligibleForMerging = False
         self._lane = self.getLeadVehicle().getLane()
         self._lanePosition = self.getLeadVehicle().getLanePosition()
-        self._controlledLanes = set()
+        # Most platoons are never controlled, so they share an empty set until they are
+        self._controlledLanes = NO_LANES
         self._targetSpeed = -1
         self._maxVehicles = maxVehicles
 
-        self.getLeadVehicle().setColor(self._color)
+        self.getLeadVehicle().setColor(self.getColor())
         self.startBehaviour(startingVehicles[1:])
 
     def addControlledLanes(self, lanes):
+        if self._controlledLanes is NO_LANES:
+            self._controlledLanes = set()
         for lane in lanes:
             self._controlledLanes.add(lane)
 
@@ -93,6 +109,9 @@ class Platoon:
         """Retrieve the list of all the vehicles in this platoon by name"""
         return [v.getName() for v in self.getAllVehicles()]
 
+    def getColor(self):
+        return (self._color >> 16, (self._color >> 8) & 255, self._color & 255)
+
     def getSpeed(self):
         return self._currentSpeed
 
@@ -205,7 +224,7 @@ class Platoon:
         """A function to start platooning a specific set of vehicles"""
         if self.isActive():
             for v in vehicles:
-                v.setColor(self._color)
+                v.setColor(self.getColor())
                 v.setImperfection(0)
                 v.setMinGap(0)
                 v.setTau(0.05)
@@ -0,0 +1,107 @@
+import itertools
+import logging
+import os
+
+import traci
+
+POOL_LOCATION = "output/pool"
+IDLE_NET_NAME = "idle.net.xml"
+# A single edge net that idle processes are parked on between runs
+IDLE_NET = """<net version="1.9" junctionCornerDetail="5" limitTurnSpeed="5.50">
+    <location netOffset="0.00,0.00" convBoundary="0.00,0.00,10.00,0.00" origBoundary="0.00,0.00,10.00,0.00" projParameter="!"/>
+    <edge id="idle" from="start" to="end" priority="-1">
+        <lane id="idle_0" index="0" speed="13.89" length="10.00" shape="0.00,-1.60 10.00,-1.60"/>
+    </edge>
+    <junction id="start" type="dead_end" x="0.00" y="0.00" incLanes="" intLanes="" shape="0.00,0.00 0.00,-3.20"/>
+    <junction id="end" type="dead_end" x="10.00" y="0.00" incLanes="idle_0" intLanes="" shape="10.00,-3.20 10.00,0.00"/>
+</net>
+"""
+
+
+class SumoPool:
+    """
+    Keeps SUMO processes alive between runs, so a run only pays for traci.load instead of
+    starting a process and waiting for it to accept a connection.
+
+    setUpSimulation(..., pool=pool) reloads an idle process with the run's options (config,
+    scale, seed, outputs and so on) and release() parks it again on a one edge net, which
+    ends the run (closing its output files) and frees the memory of its map. An idle
+    process that has exited or fails to load is closed and replaced with a new one.
+    """
+
+    def __init__(self, maxIdle=2, directory=POOL_LOCATION):
+        self.maxIdle = maxIdle
+        self.starts = 0
+        self.loads = 0
+        self.replaced = 0
+        self._idle = []
+        self._active = None
+        self._labels = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+        self._idleNet = os.path.join(directory, IDLE_NET_NAME)
+        with open(self._idleNet, "w") as f:
+            f.write(IDLE_NET)
+
+    def start(self, sumoCmd):
+        """Makes a SUMO process running sumoCmd the current TraCI connection"""
+        if self._active:
+            raise ValueError("The pool's process is still in use, release it before starting another run")
+        binary = sumoCmd[0]
+        for entry in [entry for entry in self._idle if entry[0] == binary]:
+            self._idle.remove(entry)
+            label = entry[1]
+            try:
+                if traci.getConnection(label)._process.poll() is not None:
+                    raise traci.FatalTraCIError("SUMO has exited")
+                traci.switch(label)
+                traci.load(sumoCmd[1:])
+            except (traci.FatalTraCIError, traci.TraCIException, OSError) as e:
+                logging.warning("Replacing pooled SUMO process %s: %s", label, e)
+                self._discard(label)
+                self.replaced += 1
+                continue
+            self.loads += 1
+            self._active = entry
+            return
+
+        label = "pool_%s" % next(self._labels)
+        traci.start(sumoCmd, label=label)
+        self.starts += 1
+        self._active = (binary, label)
+
+    def release(self):
+        """Ends the current run and keeps its process for the next one"""
+        if not self._active:
+            return
+        entry = self._active
+        self._active = None
+        try:
+            traci.switch(entry[1])
+            traci.load(["--net-file", self._idleNet, "--no-step-log"])
+            # SUMO answers a load before ending the old run, so wait for it to finish
+            traci.simulation.getTime()
+        except (traci.FatalTraCIError, traci.TraCIException, OSError) as e:
+            logging.warning("Dropping pooled SUMO process %s: %s", entry[1], e)
+            self._discard(entry[1])
+            return
+        if len(self._idle) < self.maxIdle:
+            self._idle.append(entry)
+        else:
+            traci.close()
+
+    def close(self):
+        """Closes every process in the pool"""
+        self.release()
+        for _, label in self._idle:
+            self._discard(label)
+        self._idle = []
+
+    @staticmethod
+    def _discard(label):
+        connection = traci.getConnection(label)
+        try:
+            connection.close()
+        except (traci.FatalTraCIError, OSError):
+            # The connection is already broken, so make sure the process is gone too
+            if connection._process is not None:
+                connection._process.kill()
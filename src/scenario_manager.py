@@ -1,7 +1,20 @@
 import logging
+import os
+import time
 import traci
 from simulationmanager import SimulationManager
-from simlib import setUpSimulation
+from simlib import getConfigFiles, setUpSimulation
+from detectors import getPreemptionDetectorFile, getQueueDetectorFile
+from checkpoint import (
+    CHECKPOINT_LOCATION,
+    Checkpointer,
+    mergeTripinfo,
+    readCheckpoint,
+    restoreControllers,
+    tripinfoSegment,
+)
+from dispatch import DispatchService
+from trajectory import TRAJECTORY_LOCATION, TrajectoryRecorder
 
 from collections import namedtuple
 
@@ -16,12 +29,20 @@ scenarioMapConfigTuple = namedtuple(
 
 DEFAULT_OUTPUT_SAVE_LOCATION = "output/additional.xml"
 
+# How far ahead (in metres) vehicles react to the ambulance's blue light in levels 3 and 4
+BLUELIGHT_REACTION_DISTANCES = {3: "10", 4: "150"}
+# Levels whose controllers read detectors, which the mesoscopic simulator does not model
+MESO_UNSUPPORTED_LEVELS = (6, 7)
+
 SCENARIO_NUMBER_CONFIGS = {
     0: scenarioNumberConfigTuple("", False, 0),
     1: scenarioNumberConfigTuple("", True, 1),
     2: scenarioNumberConfigTuple("", True, 2),
     3: scenarioNumberConfigTuple("", False, 3),
     4: scenarioNumberConfigTuple("", False, 4),
+    5: scenarioNumberConfigTuple("", True, 5),
+    6: scenarioNumberConfigTuple("", True, 6),
+    7: scenarioNumberConfigTuple("", True, 7),
 }
 
 SCENARIO_LOCATION_CONFIG = {
@@ -33,10 +54,8 @@ SCENARIO_LOCATION_CONFIG = {
 }
 
 
-def runScenario(mapName, scenarioNum, numOfSteps=20000):
-    """Runs a given scenario using the given scenario name and number."""
-    logging.info("Starting scenario for (name: %s | number: %s)")
-    # Get config information
+def getScenarioConfigs(mapName, scenarioNum):
+    """Returns the location and number configs of a scenario"""
     scenarioLocationConfig = SCENARIO_LOCATION_CONFIG.get(mapName)
     scenarioNumberConfig = SCENARIO_NUMBER_CONFIGS.get(scenarioNum)
     if not scenarioLocationConfig:
@@ -49,6 +68,52 @@ def runScenario(mapName, scenarioNum, numOfSteps=20000):
             "Could not find a scenario for the given number %s, available numbers: %s"
             % (scenarioNum, SCENARIO_NUMBER_CONFIGS.keys())
         )
+    return scenarioLocationConfig, scenarioNumberConfig
+
+
+def runScenario(
+    mapName,
+    scenarioNum,
+    numOfSteps=20000,
+    trafficScale=None,
+    gui=True,
+    stepStats=None,
+    checkpointInterval=None,
+    resume=False,
+    meso=False,
+    dispatchPort=None,
+    recordTrajectories=False,
+    seed=None,
+    pool=None,
+    pacer=None,
+):
+    """
+    Runs a given scenario using the given scenario name and number.
+    trafficScale overrides the map's default traffic scale, gui=False runs SUMO headless
+    and stepStats (see stress.StepStats) is given the controller and SUMO time of each step.
+    checkpointInterval saves a checkpoint every so many steps, and resume continues from
+    the latest checkpoint of this map and scenario number. meso=True runs the controllers
+    against the mesoscopic stand-in simulator (see mesosim.MesoSim) instead of SUMO.
+    dispatchPort starts a dispatch.DispatchService on that port (0 picks a free one) so
+    further emergency vehicles can be dispatched while the scenario runs.
+    recordTrajectories records the emergency vehicles, their leaders and the vehicles on
+    their routes with a trajectory.TrajectoryRecorder. seed sets SUMO's random seed and
+    pool (see pool.SumoPool) reuses a running SUMO process instead of starting a new one.
+    pacer (see pacing.RealTimePacer) runs the scenario at wall-clock pace, giving the
+    controllers a deadline each step.
+    """
+    if recordTrajectories and meso:
+        raise ValueError("Trajectories can only be recorded from SUMO, not the mesoscopic simulator")
+    gui = gui and not meso
+    logging.info("Starting scenario for (name: %s | number: %s)")
+    # Get config information
+    scenarioLocationConfig, scenarioNumberConfig = getScenarioConfigs(mapName, scenarioNum)
+    if meso and scenarioNumberConfig.level in MESO_UNSUPPORTED_LEVELS:
+        raise ValueError(
+            "Scenario %s relies on detectors, which the mesoscopic simulator does not have" % scenarioNum
+        )
+    if meso and (checkpointInterval or resume):
+        raise ValueError("Checkpoints need SUMO's saved state, which the mesoscopic simulator cannot save")
 
     baseScenarioName = scenarioLocationConfig.mapName
     logging.info(
@@ -73,39 +138,145 @@ def runScenario(mapName, scenarioNum, numOfSteps=20000):
         mainProjectDirectory, DEFAULT_OUTPUT_SAVE_LOCATION
     )
 
+    detectorFile = None
+    additionalFiles = []
+    if scenarioNumberConfig.level == 7:
+        additionalFiles.append(
+            getQueueDetectorFile(mainProjectDirectory, mapName, getConfigFiles(mapLocation, "net-file")[0])
+        )
+    if scenarioNumberConfig.level == 6:
+        detectorFile = getPreemptionDetectorFile(
+            mainProjectDirectory,
+            mapName,
+            getConfigFiles(mapLocation, "net-file")[0],
+            scenarioLocationConfig.forceThreshold,
+            scenarioLocationConfig.biasThreshold,
+        )
+        additionalFiles.append(detectorFile)
+
+    checkpointDirectory = "{0}/{1}".format(
+        mainProjectDirectory, CHECKPOINT_LOCATION.format(mapName, scenarioNum)
+    )
+    checkpoint = readCheckpoint(checkpointDirectory) if resume else None
+    if resume and not checkpoint:
+        raise ValueError("Could not find a checkpoint to resume from in %s" % checkpointDirectory)
+    tripinfoSegments = checkpoint["tripinfoSegments"] if checkpoint else []
+    tripinfoFile = outputFileLocation
+    if checkpointInterval or checkpoint:
+        # Each run writes its trips next to the checkpoints and they are merged into the
+        # output at the end, so trips finished before a checkpoint survive resuming from it
+        os.makedirs(checkpointDirectory, exist_ok=True)
+        tripinfoFile = tripinfoSegment(checkpointDirectory, checkpoint["step"] if checkpoint else 0)
+
     setUpSimulation(
-        mapLocation, scenarioLocationConfig.defaultTrafficScale, outputFileLocation, scenarioNumberConfig.level 
+        mapLocation,
+        trafficScale or scenarioLocationConfig.defaultTrafficScale,
+        tripinfoFile,
+        scenarioNumberConfig.level,
+        additionalFiles=additionalFiles,
+        gui=gui,
+        loadState=checkpoint["state"] if checkpoint else None,
+        saveState=bool(checkpointInterval),
+        meso=meso,
+        seed=seed,
+        pool=None if meso else pool,
     )
-    step = 0
-    manager = (
-        SimulationManager(
-            level=scenarioNumberConfig.level,
-            force_threshold=scenarioLocationConfig.forceThreshold,
-            bias_threshold=scenarioLocationConfig.biasThreshold,
-            bias_multiplier=scenarioLocationConfig.biasMultiplier,
+    dispatchService = None
+    trajectoryRecorder = None
+    try:
+        if stepStats and not meso:
+            stepStats.attach()
+        checkpointer = (
+            Checkpointer(checkpointDirectory, checkpointInterval, tripinfoSegments=tripinfoSegments, tripinfoFile=tripinfoFile)
+            if checkpointInterval
+            else None
         )
-        if scenarioNumberConfig.enableManager
-        else None
-    )
+        if checkpoint:
+            step = checkpoint["step"]
+            manager, _ = restoreControllers(checkpoint)
+        else:
+            step = 0
+            manager = (
+                SimulationManager(
+                    level=scenarioNumberConfig.level,
+                    force_threshold=scenarioLocationConfig.forceThreshold,
+                    bias_threshold=scenarioLocationConfig.biasThreshold,
+                    bias_multiplier=scenarioLocationConfig.biasMultiplier,
+                    detector_file=detectorFile,
+                )
+                if scenarioNumberConfig.enableManager
+                else None
+            )
+
+        if dispatchPort is not None:
+            dispatchService = DispatchService(
+                manager,
+                port=dispatchPort,
+                vehicleParameters=(
+                    {"device.bluelight.reactiondist": BLUELIGHT_REACTION_DISTANCES[scenarioNumberConfig.level]}
+                    if scenarioNumberConfig.level in BLUELIGHT_REACTION_DISTANCES
+                    else None
+                ),
+            )
+            dispatchService.start()
+
+        if recordTrajectories:
+            trajectoryRecorder = TrajectoryRecorder(
+                "{0}/{1}".format(mainProjectDirectory, TRAJECTORY_LOCATION.format(mapName, scenarioNum))
+            )
+
+        view_name = "View #0"
+
+        if gui:
+            traci.gui.setZoom(view_name, scenarioLocationConfig.initialZoom)
+            traci.gui.setOffset(view_name, scenarioLocationConfig.initialX, scenarioLocationConfig.initialY)
+
+        if pacer:
+            pacer.start()
+        while step < numOfSteps:
+            if scenarioLocationConfig.ambulanceStartStep and scenarioLocationConfig.ambulanceStartStep == traci.simulation.getTime():
+                traci.route.add("ambulance_route", [scenarioLocationConfig.ambulanceStartEdge, scenarioLocationConfig.ambulanceEndEdge])
+                traci.vehicle.add(vehID="ambulance", routeID="ambulance_route", typeID="ambulance", departSpeed="max")
+                if trajectoryRecorder:
+                    trajectoryRecorder.track("ambulance")
+                if gui:
+                    traci.gui.setZoom(view_name, scenarioLocationConfig.cutZoom)
+                    traci.gui.trackVehicle(view_name, "ambulance")
+                if scenarioNumberConfig.level in BLUELIGHT_REACTION_DISTANCES:
+                    traci.vehicle.setParameter("ambulance", "device.bluelight.reactiondist", BLUELIGHT_REACTION_DISTANCES[scenarioNumberConfig.level])
+            deadline = pacer.startStep() if pacer else None
+            controllerStart = time.perf_counter()
+            if dispatchService:
+                dispatchService.handleStepBoundary()
+            if manager:
+                manager.handleSimulationStep(deadline)
+            if pacer:
+                pacer.controllersDone(manager.backlog() if manager else 0)
+            sumoStart = time.perf_counter()
+            traci.simulationStep()
+            if stepStats:
+                stepStats.recordStep(sumoStart - controllerStart, time.perf_counter() - sumoStart)
+            if trajectoryRecorder:
+                trajectoryRecorder.record(manager.emergency_vehicles if manager else ())
+            step += 1
+            if checkpointer and step % checkpointer.interval == 0:
+                checkpointer.save(step, manager)
+            if pacer:
+                pacer.endStep()
 
-    view_name = "View #0"
-
-    traci.gui.setZoom(view_name, scenarioLocationConfig.initialZoom)
-    traci.gui.setOffset(view_name, scenarioLocationConfig.initialX, scenarioLocationConfig.initialY)
-
-    while step < numOfSteps:
-        if scenarioLocationConfig.ambulanceStartStep and scenarioLocationConfig.ambulanceStartStep == traci.simulation.getTime():
-            traci.route.add("ambulance_route", [scenarioLocationConfig.ambulanceStartEdge, scenarioLocationConfig.ambulanceEndEdge])
-            traci.vehicle.add(vehID="ambulance", routeID="ambulance_route", typeID="ambulance", departSpeed="max")
-            traci.gui.setZoom(view_name, scenarioLocationConfig.cutZoom)
-            traci.gui.trackVehicle(view_name, "ambulance")
-            if scenarioNumberConfig.level == 3:
-                traci.vehicle.setParameter("ambulance", "device.bluelight.reactiondist", "10")
-            elif scenarioNumberConfig.level == 4:
-                traci.vehicle.setParameter("ambulance", "device.bluelight.reactiondist", "150")
-        if manager:
-            manager.handleSimulationStep()
-        traci.simulationStep()
-        step += 1
-
-    traci.close()
+        if pacer:
+            pacer.logSummary()
+    finally:
+        # A pooled process must always be released, or the pool stays in use
+        if dispatchService:
+            dispatchService.stop()
+        if stepStats:
+            stepStats.finish()
+        if trajectoryRecorder:
+            trajectoryRecorder.close()
+        if pool and not meso:
+            pool.release()
+        else:
+            traci.close()
+    if tripinfoFile != outputFileLocation:
+        mergeTripinfo(tripinfoSegments, tripinfoFile, outputFileLocation)
@@ -1,5 +1,7 @@
 import logging
+import os
 import traci
+import xml.etree.ElementTree as ET
 from sumolib import checkBinary
 
 
@@ -8,56 +10,76 @@ def flatten(l):
     return [item for sublist in l for item in sublist]
 
 
+def getConfigFiles(configFile, option):
+    """
+    Reads a file list option (e.g. net-file, route-files, additional-files) from a
+    sumocfg, returning the files resolved relative to the config's directory
+    """
+    configDirectory = os.path.dirname(os.path.abspath(configFile))
+    element = ET.parse(configFile).getroot().find("input/%s" % option)
+    if element is None or not element.get("value"):
+        return []
+    return [
+        os.path.join(configDirectory, fileName.strip())
+        for fileName in element.get("value").split(",")
+    ]
+
+
 def setUpSimulation(
     configFile, trafficScale=1, outputFileLocation="output/additional.xml"
-, level=0):
-    # Check SUMO has been set up properly
-    sumoBinary = checkBinary("sumo-gui")
-
+, level=0, additionalFiles=None, gui=True, loadState=None, saveState=False, meso=False, routeFiles=None, seed=None, pool=None):
     # Set up logger
     logging.basicConfig(format="%(asctime)s %(message)s")
     root = logging.getLogger()
     root.setLevel(logging.DEBUG)
-    if level>2:
+
+    if meso:
+        # Imported here so NumPy is only needed when the mesoscopic simulator is used
+        from mesosim import MesoSim
+
+        MesoSim(configFile, trafficScale, tripinfoOutput=outputFileLocation).start()
+        return
+
+    # Check SUMO has been set up properly
+    sumoBinary = checkBinary("sumo-gui" if gui else "sumo")
+
+    sumoCmd = [
+        sumoBinary,
+        "-c",
+        configFile,
+    ]
+    if level in (3, 4):
+        sumoCmd += ["--lateral-resolution", "2.5"]
+    sumoCmd += [
+        "--step-length",
+        "0.1",
+        "--collision.action",
+        "none",
+        "--start",
+        "--tripinfo-output",
+        outputFileLocation,
+        "--duration-log.statistics",
+        "--scale",
+        str(trafficScale),
+    ]
+    if loadState:
+        sumoCmd += ["--load-state", loadState]
+    if saveState:
+        # Needed for a resumed run to continue exactly as the original would have
+        sumoCmd += ["--save-state.rng", "--save-state.precision", "6"]
+    if seed is not None:
+        sumoCmd += ["--seed", str(seed)]
+    if routeFiles:
+        sumoCmd += ["--route-files", ",".join(routeFiles)]
+    if additionalFiles:
+        # Passing --additional-files replaces the config's list, so keep those too
+        sumoCmd += [
+            "--additional-files",
+            ",".join(getConfigFiles(configFile, "additional-files") + list(additionalFiles)),
+        ]
     # Start Simulation and step through
-        traci.start(
-            [
-                sumoBinary,
-                "-c",
-                configFile,
-                "--lateral-resolution",
-                "2.5",
-                "--step-length",
-                "0.1",
-                "--collision.action",
-                "none",
-                "--start",
-                "--tripinfo-output",
-                outputFileLocation,
-                # "--additional-files",
-                # outputFileLocation,
-                "--duration-log.statistics",
-                "--scale",
-                str(trafficScale),
-            ]
-        )
+    if pool:
+        # Reuses one of the pool's running SUMO processes when it can
+        pool.start(sumoCmd)
     else:
-        traci.start(
-            [
-                sumoBinary,
-                "-c",
-                configFile,
-                "--step-length",
-                "0.1",
-                "--collision.action",
-                "none",
-                "--start",
-                "--tripinfo-output",
-                outputFileLocation,
-                # "--additional-files",
-                # outputFileLocation,
-                "--duration-log.statistics",
-                "--scale",
-                str(trafficScale),
-            ]
-        )
+        traci.start(sumoCmd)
@@ -1,35 +1,218 @@
+import time
+
 import traci
+from traci import constants as tc
 
-from vehicle import Vehicle
+from corridor import CorridorPlanner
+from detectors import readPreemptionDetectors
+from maxpressure import MaxPressureController
+from vehicle import TrafficLightNetwork, TrafficLightState, Vehicle
 
 
 class SimulationManager:
-    def __init__(self, level, force_threshold, bias_threshold, bias_multiplier):
+    def __init__(self, level, force_threshold, bias_threshold, bias_multiplier, detector_file=None):
         self.emergency_vehicles = {}
+        # Light programs and routes shared between the emergency vehicles
+        self.traffic_light_network = TrafficLightNetwork()
+        self.awaiting_departure = set()
+        self.corridor_plans = {}
         self.level = level
-        self.bias_mode = self.level == 2
+        self.bias_mode = self.level in (2, 5, 6)
+        self.corridor_mode = self.level == 5
+        self.detector_mode = self.level == 6
         self.force_threshold = force_threshold
         self.bias_threshold = bias_threshold
         self.bias_multiplier = bias_multiplier
+        self.detectors = {}
+        # Biases put off until a step with time to spare, keyed by vehicle and light
+        self.postponed_bias = {}
+        self._deadline = None
+        # Level 7 hands every traffic light not preempted by an emergency vehicle to max-pressure control
+        self.max_pressure = MaxPressureController() if self.level == 7 else None
+        if self.detector_mode:
+            self.subscribeToDetectors(detector_file)
+        elif self.corridor_mode:
+            self.restoreSubscriptions()
+
+    def subscribeToDetectors(self, detector_file):
+        """
+        Subscribes to the preemption detectors in the given file, along with the vehicles
+        departing and arriving each step so emergency vehicles can be tracked without
+        polling every vehicle in the network
+        """
+        self.detectors = readPreemptionDetectors(detector_file)
+        self.restoreSubscriptions()
+
+    def restoreSubscriptions(self):
+        """(Re)creates the TraCI subscriptions the manager depends on, e.g. after resuming a checkpoint"""
+        if self.max_pressure:
+            self.max_pressure.restoreSubscriptions()
+        if not (self.detector_mode or self.corridor_mode):
+            return
+        for detector_id in self.detectors:
+            traci.inductionloop.subscribe(detector_id, [tc.LAST_STEP_VEHICLE_ID_LIST])
+        traci.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS])
 
-    def handleSimulationStep(self):
+    def handleSimulationStep(self, deadline=None):
+        """
+        Runs the controllers for one step. Given a deadline (a time.perf_counter() value),
+        forcing and clearing are always done, but biasing and max-pressure decisions are
+        postponed to a later step once the deadline has passed
+        """
+        self._deadline = deadline
+        if self.detector_mode:
+            self.handleDetectorEvents()
+        elif self.corridor_mode:
+            self.handleCorridors()
+        else:
+            self.handleEmergencyVehicles()
+        self.handleOptionalWork()
+
+    def handleEmergencyVehicles(self):
         allVehicles = traci.vehicle.getIDList()
 
         for vehicle_id in allVehicles:
             if traci.vehicle.getTypeID(vehicle_id) == "ambulance" and not vehicle_id in self.emergency_vehicles:
-                self.emergency_vehicles[vehicle_id] = Vehicle(vehicle_id, self.bias_mode)
+                self.emergency_vehicles[vehicle_id] = Vehicle(vehicle_id, self.bias_mode, self.traffic_light_network)
 
         vehicle_ids_to_delete = []
+        running_vehicles = set(allVehicles) if self.emergency_vehicles else ()
 
         for vehicle_id, emergency_vehicle in self.emergency_vehicles.items():
-            if not vehicle_id in allVehicles:
-                vehicle_ids_to_delete.append(vehicle_id)
-            else:
-                emergency_vehicle.calculate_traffic_light_distances(
+            if not vehicle_id in running_vehicles:
+                if vehicle_id not in self.awaiting_departure:
+                    vehicle_ids_to_delete.append(vehicle_id)
+                continue
+            self.awaiting_departure.discard(vehicle_id)
+            self.calculateTrafficLightDistances(emergency_vehicle)
+
+        for vehicle_id in vehicle_ids_to_delete:
+            del self.emergency_vehicles[vehicle_id]
+
+    def handleCorridors(self):
+        """
+        Plans a corridor for each emergency vehicle as it departs and replays the plans,
+        finding the vehicles from the ones departing and arriving each step rather than
+        polling every vehicle in the network
+        """
+        simulation_results = traci.simulation.getSubscriptionResults()
+        for vehicle_id in simulation_results.get(tc.VAR_DEPARTED_VEHICLES_IDS, ()):
+            if vehicle_id in self.awaiting_departure or traci.vehicle.getTypeID(vehicle_id) == "ambulance":
+                self.awaiting_departure.discard(vehicle_id)
+                emergency_vehicle = self.emergency_vehicles.get(vehicle_id) or Vehicle(vehicle_id, self.bias_mode, self.traffic_light_network)
+                self.emergency_vehicles[vehicle_id] = emergency_vehicle
+                self.corridor_plans[vehicle_id] = CorridorPlanner(
+                    emergency_vehicle,
                     force_threshold=self.force_threshold,
                     bias_threshold=self.bias_threshold,
                     bias_multiplier=self.bias_multiplier,
                 )
 
-        for vehicle_id in vehicle_ids_to_delete:
-            del self.emergency_vehicles[vehicle_id]
+        for vehicle_id in simulation_results.get(tc.VAR_ARRIVED_VEHICLES_IDS, ()):
+            self.emergency_vehicles.pop(vehicle_id, None)
+            self.corridor_plans.pop(vehicle_id, None)
+
+        if self.corridor_plans:
+            now = traci.simulation.getTime()
+            for corridor_plan in self.corridor_plans.values():
+                corridor_plan.step(now)
+
+    def calculateTrafficLightDistances(self, emergency_vehicle):
+        for traffic_light in emergency_vehicle.calculate_traffic_light_distances(
+            force_threshold=self.force_threshold,
+            bias_threshold=self.bias_threshold,
+            bias_multiplier=self.bias_multiplier,
+            defer_bias=self._deadline is not None,
+        ):
+            self.postponeBias(emergency_vehicle, traffic_light)
+
+    def postponeBias(self, emergency_vehicle, traffic_light):
+        self.postponed_bias.setdefault(
+            (emergency_vehicle.id, traffic_light.id), (emergency_vehicle, traffic_light)
+        )
+
+    def handleOptionalWork(self):
+        """Applies postponed biases and makes max-pressure decisions while there is time left"""
+        for key, (emergency_vehicle, traffic_light) in list(self.postponed_bias.items()):
+            if self._deadline is not None and time.perf_counter() >= self._deadline:
+                break
+            del self.postponed_bias[key]
+            # The light may have been forced or passed, or its vehicle gone, in the meantime
+            if (
+                emergency_vehicle.id in self.emergency_vehicles
+                and traffic_light.status is TrafficLightState.NONE
+                and traffic_light.current_distance >= 0
+            ):
+                traffic_light.bias(self.bias_multiplier, emergency_vehicle._route_edge_pairs)
+
+        if self.max_pressure:
+            self.max_pressure.step(
+                traci.simulation.getTime(),
+                self.preemptedTrafficLights(),
+                decide=self._deadline is None or time.perf_counter() < self._deadline,
+            )
+
+    def backlog(self):
+        """The optional work currently postponed"""
+        postponed = sum(1 for vehicle_id, _ in self.postponed_bias if vehicle_id in self.emergency_vehicles)
+        return postponed + (1 if self.max_pressure and self.max_pressure.overdue else 0)
+
+    def preemptedTrafficLights(self):
+        """The ids of the traffic lights currently forced or biased for an emergency vehicle"""
+        return {
+            traffic_light.id
+            for emergency_vehicle in self.emergency_vehicles.values()
+            for traffic_light in emergency_vehicle._traffic_lights_on_route
+            if traffic_light.status is not TrafficLightState.NONE
+        }
+
+    def registerEmergencyVehicle(self, vehicle_id):
+        """
+        Starts tracking an emergency vehicle that has been added through TraCI but may not
+        have departed yet, so it is not forgotten before it enters the network
+        """
+        if vehicle_id not in self.emergency_vehicles:
+            self.emergency_vehicles[vehicle_id] = Vehicle(vehicle_id, self.bias_mode, self.traffic_light_network)
+            self.awaiting_departure.add(vehicle_id)
+
+    def handleDetectorEvents(self):
+        """
+        Acts only on the detectors that an emergency vehicle passed over during the last step
+        """
+        simulation_results = traci.simulation.getSubscriptionResults()
+        for vehicle_id in simulation_results.get(tc.VAR_DEPARTED_VEHICLES_IDS, ()):
+            if vehicle_id in self.awaiting_departure or traci.vehicle.getTypeID(vehicle_id) == "ambulance":
+                self.awaiting_departure.discard(vehicle_id)
+                emergency_vehicle = self.emergency_vehicles.get(vehicle_id) or Vehicle(vehicle_id, self.bias_mode, self.traffic_light_network)
+                self.emergency_vehicles[vehicle_id] = emergency_vehicle
+                # Lights the vehicle departed within range of will never see it cross their detectors
+                self.calculateTrafficLightDistances(emergency_vehicle)
+
+        for detector_id, results in traci.inductionloop.getAllSubscriptionResults().items():
+            for vehicle_id in results[tc.LAST_STEP_VEHICLE_ID_LIST]:
+                self.handleDetectorTrigger(detector_id, vehicle_id)
+
+        for vehicle_id in simulation_results.get(tc.VAR_ARRIVED_VEHICLES_IDS, ()):
+            self.emergency_vehicles.pop(vehicle_id, None)
+
+    def handleDetectorTrigger(self, detector_id, vehicle_id):
+        traffic_light_id, kind, edge, detector_edge = self.detectors[detector_id]
+        emergency_vehicle = self.emergency_vehicles.get(vehicle_id)
+        if emergency_vehicle is None or detector_edge not in emergency_vehicle._route:
+            return
+
+        for traffic_light in emergency_vehicle._traffic_lights_on_route:
+            if traffic_light.id != traffic_light_id:
+                continue
+            if kind == "clear":
+                if traffic_light.edge_to == edge and traffic_light.status is not TrafficLightState.NONE:
+                    traffic_light.clear(vehicle_id)
+            elif traffic_light.edge_from != edge:
+                continue
+            elif kind == "force" and traffic_light.status is not TrafficLightState.FORCED:
+                traffic_light.force(vehicle_id, emergency_vehicle._route_edge_pairs)
+            elif kind == "bias" and traffic_light.status is TrafficLightState.NONE:
+                if self._deadline is not None:
+                    self.postponeBias(emergency_vehicle, traffic_light)
+                else:
+                    traffic_light.bias(self.bias_multiplier, emergency_vehicle._route_edge_pairs)
@@ -0,0 +1,238 @@
+import argparse
+import csv
+import logging
+import resource
+import time
+import xml.etree.ElementTree as ET
+
+import traci
+
+from pool import POOL_LOCATION, SumoPool
+from scenario_manager import (
+    runScenario,
+    DEFAULT_OUTPUT_SAVE_LOCATION,
+    SCENARIO_LOCATION_CONFIG,
+)
+
+STRESS_REPORT_LOCATION = "output/stress_{0}_{1}.csv"
+STEP_LENGTH = 0.1
+# How often (in steps) the number of running vehicles is sampled
+VEHICLE_COUNT_INTERVAL = 10
+
+
+class StepStats:
+    """
+    Collects the per step timings of a single run. runScenario reports the time
+    spent in the controllers and in SUMO for every step, while TraCI calls are
+    counted by wrapping the command sender of the active connection.
+    """
+
+    def __init__(self):
+        self.sumoTimes = []
+        self.controllerTimes = []
+        self.traciCalls = 0
+        self.peakVehicles = 0
+        self.sumoPeakRSS = None
+        self._connection = None
+        self._sendCmd = None
+        self._counting = True
+
+    def attach(self):
+        """Starts counting commands sent over the current TraCI connection"""
+        self._connection = traci.getConnection(traci.getLabel())
+        self._sendCmd = sendCmd = self._connection._sendCmd
+        process = getattr(self._connection, "_process", None)
+        if process is not None:
+            # A pooled SUMO process keeps its peak RSS from earlier runs
+            _resetPeakRSS(process.pid)
+
+        def countingSendCmd(*args, **kwargs):
+            if self._counting:
+                self.traciCalls += 1
+            return sendCmd(*args, **kwargs)
+
+        self._connection._sendCmd = countingSendCmd
+
+    def recordStep(self, controllerTime, sumoTime):
+        self.controllerTimes.append(controllerTime)
+        self.sumoTimes.append(sumoTime)
+        if len(self.sumoTimes) % VEHICLE_COUNT_INTERVAL == 0:
+            # Sampling the vehicle count is our own overhead, so leave it uncounted
+            self._counting = False
+            self.peakVehicles = max(self.peakVehicles, traci.vehicle.getIDCount())
+            self._counting = True
+
+    def finish(self):
+        """Reads SUMO's peak RSS and stops counting, must be called before the connection is closed"""
+        process = getattr(self._connection, "_process", None)
+        if process is not None:
+            self.sumoPeakRSS = _readPeakRSS(process.pid)
+        if self._sendCmd:
+            # The connection may be reused by the next run
+            self._connection._sendCmd = self._sendCmd
+
+    def summary(self):
+        steps = len(self.sumoTimes) or 1
+        totals = sorted(c + s for c, s in zip(self.controllerTimes, self.sumoTimes))
+        meanTotal = sum(totals) / steps
+        return {
+            "steps": len(self.sumoTimes),
+            "peakVehicles": self.peakVehicles,
+            "sumoStepMs": 1000 * sum(self.sumoTimes) / steps,
+            "controllerStepMs": 1000 * sum(self.controllerTimes) / steps,
+            "p95StepMs": 1000 * totals[int(0.95 * (len(totals) - 1))] if totals else 0,
+            "overBudgetSteps": sum(1 for total in totals if total > STEP_LENGTH) / steps,
+            "realTimeFactor": STEP_LENGTH / meanTotal if meanTotal else float("inf"),
+            "traciCallsPerStep": self.traciCalls / steps,
+            "sumoPeakRSSMB": self.sumoPeakRSS / 1024 if self.sumoPeakRSS else None,
+            "pythonPeakRSSMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+def _readPeakRSS(pid):
+    """Reads the peak resident set size (in KB) of a process, only available on Linux"""
+    try:
+        with open("/proc/%s/status" % pid) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        logging.warning("Could not read the peak RSS of process %s", pid)
+    return None
+
+
+def _resetPeakRSS(pid):
+    try:
+        with open("/proc/%s/clear_refs" % pid, "w") as clearRefs:
+            clearRefs.write("5")
+    except OSError:
+        logging.warning("Could not reset the peak RSS of process %s", pid)
+
+
+def readAmbulanceKPIs(tripinfoFile):
+    """Reads the ambulance trips (and the mean time loss of all trips) from a tripinfo output"""
+    ambulanceTrips = []
+    timeLosses = []
+    for _, trip in ET.iterparse(tripinfoFile):
+        if trip.tag != "tripinfo":
+            continue
+        timeLosses.append(float(trip.get("timeLoss")))
+        if trip.get("vType") == "ambulance":
+            ambulanceTrips.append(dict(trip.attrib))
+        trip.clear()
+    kpis = {
+        "ambulances": len(ambulanceTrips),
+        "ambulanceDuration": None,
+        "ambulanceTimeLoss": None,
+        "ambulanceWaitingTime": None,
+        "meanTimeLoss": sum(timeLosses) / len(timeLosses) if timeLosses else None,
+    }
+    if ambulanceTrips:
+        for key, attribute in (
+            ("ambulanceDuration", "duration"),
+            ("ambulanceTimeLoss", "timeLoss"),
+            ("ambulanceWaitingTime", "waitingTime"),
+        ):
+            kpis[key] = sum(float(t.get(attribute)) for t in ambulanceTrips) / len(ambulanceTrips)
+    return kpis
+
+
+def runStressSweep(mapName, scenarioNum, scales, numOfSteps=20000, mainProjectDirectory=".", pool=None):
+    """
+    Runs the given scenario headless once per traffic scale, returning a row of step
+    timings, TraCI load, memory and ambulance KPIs for each level. With a pool.SumoPool
+    every run after the first reuses the same SUMO process.
+    """
+    rows = []
+    for scale in scales:
+        logging.info("Stress run for %s scenario %s at scale %s", mapName, scenarioNum, scale)
+        stats = StepStats()
+        started = time.perf_counter()
+        runScenario(
+            mapName,
+            scenarioNum,
+            numOfSteps,
+            trafficScale=scale,
+            gui=False,
+            stepStats=stats,
+            pool=pool,
+        )
+        row = {"scale": scale, "wallTime": time.perf_counter() - started}
+        row.update(stats.summary())
+        row.update(
+            readAmbulanceKPIs("{0}/{1}".format(mainProjectDirectory, DEFAULT_OUTPUT_SAVE_LOCATION))
+        )
+        rows.append(row)
+    return rows
+
+
+def writeScalingReport(rows, reportFile):
+    with open(reportFile, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    columns = [
+        ("scale", "%g"),
+        ("peakVehicles", "%d"),
+        ("sumoStepMs", "%.2f"),
+        ("controllerStepMs", "%.2f"),
+        ("p95StepMs", "%.2f"),
+        ("realTimeFactor", "%.2f"),
+        ("traciCallsPerStep", "%.1f"),
+        ("sumoPeakRSSMB", "%.0f"),
+        ("ambulanceDuration", "%.1f"),
+    ]
+    print(" ".join("%18s" % name for name, _ in columns))
+    for row in rows:
+        print(
+            " ".join(
+                "%18s" % ("-" if row[name] is None else fmt % row[name])
+                for name, fmt in columns
+            )
+        )
+
+    # The control loop keeps up while a step (SUMO + controllers) takes less than the step length
+    behind = [row for row in rows if row["realTimeFactor"] < 1]
+    if behind:
+        print(
+            "Control loop falls behind real time from scale %g (%d vehicles, %.2fx real time)"
+            % (behind[0]["scale"], behind[0]["peakVehicles"], behind[0]["realTimeFactor"])
+        )
+    else:
+        print("Control loop kept up with real time at every scale tested")
+    print("Report written to %s" % reportFile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweeps the traffic scale of a scenario and reports where the control loop stops keeping up with real time"
+    )
+    parser.add_argument("mapName", choices=SCENARIO_LOCATION_CONFIG.keys())
+    parser.add_argument("scenarioNum", type=int)
+    parser.add_argument("--min-scale", type=float, default=1)
+    parser.add_argument("--max-scale", type=float, default=5)
+    parser.add_argument("--scale-step", type=float, default=1)
+    parser.add_argument("--steps", type=int, default=20000)
+    parser.add_argument("--pool", action="store_true", help="Reuse one SUMO process for every run")
+    args = parser.parse_args()
+
+    currPath = __file__.replace("\\", "/")
+    mainProjectDirectory = "/".join(currPath.split("/")[: currPath.split("/").index("src")])
+
+    scales = []
+    scale = args.min_scale
+    while scale <= args.max_scale + 1e-9:
+        scales.append(round(scale, 6))
+        scale += args.scale_step
+
+    pool = SumoPool(directory="{0}/{1}".format(mainProjectDirectory, POOL_LOCATION)) if args.pool else None
+    try:
+        rows = runStressSweep(args.mapName, args.scenarioNum, scales, args.steps, mainProjectDirectory, pool)
+    finally:
+        if pool:
+            pool.close()
+    writeScalingReport(
+        rows,
+        "{0}/{1}".format(mainProjectDirectory, STRESS_REPORT_LOCATION.format(args.mapName, args.scenarioNum)),
+    )
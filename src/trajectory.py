@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+
+import numpy as np
+import traci
+from traci import constants as tc
+
+TRAJECTORY_LOCATION = "output/trajectories/{0}_{1}"
+MANIFEST_NAME = "trajectory.json"
+# How far ahead (in metres) the leader of an emergency vehicle is looked for
+LEADER_DISTANCE = 200
+CHUNK_ROWS = 65536
+
+# Why a row was recorded, as bit flags in the role column
+EMERGENCY = 1
+LEADER = 2
+ROUTE = 4
+
+COLUMNS = (
+    ("time", "<f8"),
+    ("vehicle", "<i4"),
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("speed", "<f4"),
+    ("lane", "<i4"),
+    ("edge", "<i4"),
+    ("role", "u1"),
+)
+VEHICLE_VARIABLES = [tc.VAR_POSITION, tc.VAR_SPEED, tc.VAR_LANE_ID, tc.VAR_ROAD_ID]
+
+
+class TrajectoryRecorder:
+    """
+    Records the trajectories of emergency vehicles, their leaders and every vehicle on
+    the edges of their routes, a compact alternative to SUMO's XML FCD output.
+
+    Vehicles are followed through subscriptions which are only held while a vehicle is
+    selected, and the edges of a route only while an emergency vehicle on it is. Rows are
+    buffered and appended a chunk at a time to one fixed-width binary file per column.
+    Vehicle, lane and edge ids are stored as indices into the tables in the manifest,
+    which close() writes along with a copy of every column ordered by vehicle, so both
+    time windows and single vehicles can be read back as contiguous slices. Recordings
+    are read back with TrajectoryReader.
+    """
+
+    def __init__(self, directory, chunkRows=CHUNK_ROWS):
+        self.directory = directory
+        self.chunkRows = chunkRows
+        self.rows = 0
+        self._tracked = set()
+        self._subscribed = {}
+        self._emergencyRoutes = {}
+        self._edgeCounts = {}
+        self._vehicleIndex = {}
+        self._laneIndex = {}
+        self._edgeIndex = {}
+        self._buffers = {name: [] for name, _ in COLUMNS}
+        os.makedirs(directory, exist_ok=True)
+        self._files = {name: open(self._columnFile(name), "wb") for name, _ in COLUMNS}
+
+    def _columnFile(self, name):
+        return os.path.join(self.directory, "%s.bin" % name)
+
+    def track(self, vehicle_id):
+        """Records the given vehicle as an emergency vehicle, e.g. one without a SimulationManager"""
+        self._tracked.add(vehicle_id)
+
+    def record(self, emergency_vehicle_ids=()):
+        """Records the selected vehicles, to be called after each simulation step"""
+        results = traci.vehicle.getAllSubscriptionResults()
+        for vehicle_id in [v for v in self._subscribed if v not in results]:
+            # Arrived (or teleported away), SUMO has already dropped its subscription
+            del self._subscribed[vehicle_id]
+            self._tracked.discard(vehicle_id)
+            self._releaseRoute(vehicle_id)
+
+        wanted = dict.fromkeys(self._tracked.union(emergency_vehicle_ids), EMERGENCY)
+        for vehicle_id in list(wanted):
+            leader = results.get(vehicle_id, {}).get(tc.VAR_LEADER)
+            if leader and leader[0]:
+                wanted[leader[0]] = wanted.get(leader[0], 0) | LEADER
+        for edge_results in traci.edge.getAllSubscriptionResults().values():
+            for vehicle_id in edge_results[tc.LAST_STEP_VEHICLE_ID_LIST]:
+                wanted[vehicle_id] = wanted.get(vehicle_id, 0) | ROUTE
+
+        for vehicle_id in [v for v in self._subscribed if v not in wanted]:
+            traci.vehicle.unsubscribe(vehicle_id)
+            del self._subscribed[vehicle_id]
+            self._releaseRoute(vehicle_id)
+        for vehicle_id, role in wanted.items():
+            emergency = bool(role & EMERGENCY)
+            if self._subscribed.get(vehicle_id) != emergency:
+                self._subscribe(vehicle_id, emergency)
+
+        time = traci.simulation.getTime()
+        results = traci.vehicle.getAllSubscriptionResults()
+        buffers = self._buffers
+        for vehicle_id, role in wanted.items():
+            result = results.get(vehicle_id)
+            if not result or not result[tc.VAR_ROAD_ID]:
+                # Not inserted yet
+                continue
+            x, y = result[tc.VAR_POSITION]
+            buffers["time"].append(time)
+            buffers["vehicle"].append(_index(self._vehicleIndex, vehicle_id))
+            buffers["x"].append(x)
+            buffers["y"].append(y)
+            buffers["speed"].append(result[tc.VAR_SPEED])
+            buffers["lane"].append(_index(self._laneIndex, result[tc.VAR_LANE_ID]))
+            buffers["edge"].append(_index(self._edgeIndex, result[tc.VAR_ROAD_ID]))
+            buffers["role"].append(role)
+        if len(buffers["time"]) >= self.chunkRows:
+            self._flush()
+
+    def _subscribe(self, vehicle_id, emergency):
+        self._releaseRoute(vehicle_id)
+        try:
+            if emergency:
+                traci.vehicle.subscribe(
+                    vehicle_id,
+                    VEHICLE_VARIABLES + [tc.VAR_LEADER],
+                    parameters={tc.VAR_LEADER: ("d", LEADER_DISTANCE)},
+                )
+                route = set(traci.vehicle.getRoute(vehicle_id))
+            else:
+                traci.vehicle.subscribe(vehicle_id, VEHICLE_VARIABLES)
+        except traci.TraCIException:
+            # Tracked before it has been added, try again next step
+            return
+        self._subscribed[vehicle_id] = emergency
+        if emergency:
+            # Edges are shared between the routes of emergency vehicles, so count their users
+            self._emergencyRoutes[vehicle_id] = route
+            for edge_id in route:
+                self._edgeCounts[edge_id] = self._edgeCounts.get(edge_id, 0) + 1
+                if self._edgeCounts[edge_id] == 1:
+                    traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_ID_LIST])
+
+    def _releaseRoute(self, vehicle_id):
+        for edge_id in self._emergencyRoutes.pop(vehicle_id, ()):
+            self._edgeCounts[edge_id] -= 1
+            if not self._edgeCounts[edge_id]:
+                del self._edgeCounts[edge_id]
+                traci.edge.unsubscribe(edge_id)
+
+    def _flush(self):
+        for name, dtype in COLUMNS:
+            np.asarray(self._buffers[name], dtype=dtype).tofile(self._files[name])
+            self._buffers[name].clear()
+
+    def close(self):
+        """Writes the remaining rows, the columns ordered by vehicle and the manifest"""
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+        self.rows = os.path.getsize(self._columnFile("vehicle")) // np.dtype("<i4").itemsize
+        counts = self._writeByVehicle()
+        np.concatenate(([0], np.cumsum(counts))).astype("<i8").tofile(self._columnFile("vehicle_offsets"))
+
+        manifest = {
+            "rows": self.rows,
+            "columns": dict(COLUMNS),
+            "roles": {"emergency": EMERGENCY, "leader": LEADER, "route": ROUTE},
+            "vehicles": list(self._vehicleIndex),
+            "lanes": list(self._laneIndex),
+            "edges": list(self._edgeIndex),
+        }
+        with open(os.path.join(self.directory, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+        logging.info(
+            "Recorded %s trajectory rows of %s vehicles to %s",
+            self.rows,
+            len(self._vehicleIndex),
+            self.directory,
+        )
+
+
+    def _writeByVehicle(self):
+        """
+        Writes the copy of the columns ordered by vehicle through memmaps, a chunk of rows
+        at a time so no column is ever read whole, returning the rows of each vehicle
+        """
+        columns = {name: _map(self._columnFile(name), dtype, self.rows) for name, dtype in COLUMNS}
+        vehicles = columns["vehicle"]
+        counts = np.zeros(len(self._vehicleIndex), dtype="<i8")
+        for start in range(0, self.rows, self.chunkRows):
+            counts += np.bincount(vehicles[start:start + self.chunkRows], minlength=len(counts))
+        if not self.rows:
+            for name, _ in COLUMNS:
+                open(self._columnFile("by_vehicle_%s" % name), "wb").close()
+            return counts
+
+        byVehicle = {
+            name: np.memmap(self._columnFile("by_vehicle_%s" % name), dtype=dtype, mode="w+", shape=(self.rows,))
+            for name, dtype in COLUMNS
+        }
+        # Where the next row of each vehicle goes. Rows are in time order, so filling each
+        # vehicle's rows in the order they come keeps them in time order too
+        nextRows = np.cumsum(counts) - counts
+        for start in range(0, self.rows, self.chunkRows):
+            chunk = np.asarray(vehicles[start:start + self.chunkRows])
+            order = np.argsort(chunk, kind="stable")
+            chunkCounts = np.bincount(chunk, minlength=len(counts))
+            sortedVehicles = chunk[order]
+            # Each row's place among the chunk's rows of the same vehicle
+            ranks = np.arange(len(chunk)) - (np.cumsum(chunkCounts) - chunkCounts)[sortedVehicles]
+            destinations = np.empty(len(chunk), dtype=np.int64)
+            destinations[order] = nextRows[sortedVehicles] + ranks
+            nextRows += chunkCounts
+            for name, column in columns.items():
+                byVehicle[name][destinations] = column[start:start + self.chunkRows]
+        for column in byVehicle.values():
+            column.flush()
+        return counts
+
+
+def _index(table, key):
+    return table.setdefault(key, len(table))
+
+
+class TrajectoryReader:
+    """
+    Memory-maps a recording made by TrajectoryRecorder. Columns are returned as a dict
+    of arrays, always views into the mapped files: time windows are found by binary
+    search on the time column, and a vehicle's rows are a slice of the columns ordered
+    by vehicle, found through the per-vehicle offsets.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.rows = manifest["rows"]
+        self.roles = manifest["roles"]
+        self.vehicleIDs = manifest["vehicles"]
+        self.laneIDs = manifest["lanes"]
+        self.edgeIDs = manifest["edges"]
+        self._vehicleIndex = {vehicle_id: i for i, vehicle_id in enumerate(self.vehicleIDs)}
+        self.columns = {
+            name: _map(os.path.join(directory, "%s.bin" % name), dtype, self.rows)
+            for name, dtype in manifest["columns"].items()
+        }
+        self._vehicleColumns = {
+            name: _map(os.path.join(directory, "by_vehicle_%s.bin" % name), dtype, self.rows)
+            for name, dtype in manifest["columns"].items()
+        }
+        self._vehicleOffsets = _map(
+            os.path.join(directory, "vehicle_offsets.bin"), "<i8", len(self.vehicleIDs) + 1
+        )
+
+    def window(self, start=None, end=None):
+        """The rows recorded from start up to (but excluding) end, as views into the files"""
+        times = self.columns["time"]
+        first = 0 if start is None else np.searchsorted(times, start, side="left")
+        last = len(times) if end is None else np.searchsorted(times, end, side="left")
+        return {name: column[first:last] for name, column in self.columns.items()}
+
+    def vehicle(self, vehicle_id, start=None, end=None):
+        """The rows of a single vehicle, optionally limited to a time window, as views into the files"""
+        v = self._vehicleIndex.get(vehicle_id)
+        if v is None:
+            raise ValueError("No trajectory was recorded for vehicle %s" % vehicle_id)
+        first = self._vehicleOffsets[v]
+        last = self._vehicleOffsets[v + 1]
+        times = self._vehicleColumns["time"][first:last]
+        if end is not None:
+            last = first + np.searchsorted(times, end, side="left")
+        if start is not None:
+            first += np.searchsorted(times, start, side="left")
+        return {name: column[first:last] for name, column in self._vehicleColumns.items()}
+
+
+def _map(path, dtype, length):
+    if not length:
+        # mmap cannot map an empty file
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
@@ -1,4 +1,5 @@
 import traci
+from array import array
 from enum import Enum
 
 from traci._trafficlight import Phase, Logic
@@ -14,27 +15,123 @@ def lane_to_edge(lane):
     return lane.split("_")[0]
 
 
-class TrafficLight:
+class TrafficLightProgram:
+    """
+    What every TrafficLight of the same light shares: its original program and the
+    (from edge, to edge) pair of each of its links (None for a link without lanes)
+    """
+
+    __slots__ = ("id", "original_logic", "link_edge_pairs")
 
-    def __init__(self, traffic_light_id, edge_from, edge_to, advance_phase_on_clear=False):
+    def __init__(self, traffic_light_id):
         self.id = traffic_light_id
+        self.original_logic = traci.trafficlight.getAllProgramLogics(traffic_light_id)[0]
+        self.link_edge_pairs = tuple(
+            (lane_to_edge(link[0][0]), lane_to_edge(link[0][1])) if link else None
+            for link in traci.trafficlight.getControlledLinks(traffic_light_id)
+        )
+
+
+class Route:
+    """
+    The data of a route shared by every vehicle following it: its edge pairs, the lights
+    it passes through (as (program, edge from, edge to, route index) tuples) and the
+    cumulative length of its edges, so that edge_offsets[j] - edge_offsets[i] is the length
+    of edges i to j - 1
+    """
+
+    __slots__ = ("edges", "edge_pairs", "traffic_lights", "edge_offsets")
+
+    def __init__(self, edges, network):
+        self.edges = edges
+        self.edge_pairs = frozenset(zip(edges, edges[1:]))
+        self.traffic_lights = network.traffic_lights_on(self.edge_pairs, edges)
+        self.edge_offsets = array("d", [0])
+        for edge_id in edges:
+            self.edge_offsets.append(self.edge_offsets[-1] + traci.lane.getLength(f"{edge_id}_0"))
+
+
+class TrafficLightNetwork:
+    """
+    Keeps one TrafficLightProgram per light and one Route per distinct route for all the
+    vehicles of a simulation, indexing the lights by the edge pairs they control so a
+    vehicle's lights are found without going through every light in the network
+    """
+
+    __slots__ = ("_programs", "_lights_by_edge_pair", "_routes")
+
+    def __init__(self):
+        self._programs = None
+        self._lights_by_edge_pair = None
+        self._routes = {}
+
+    def route(self, edges):
+        route = self._routes.get(edges)
+        if route is None:
+            route = self._routes[edges] = Route(edges, self)
+        return route
+
+    def index(self):
+        """Reads every light's program now, before anything changes them, if not done yet"""
+        if self._programs is None:
+            self._index()
+
+    def traffic_lights_on(self, edge_pairs, edges):
+        self.index()
+        traffic_lights = []
+        # In the order of getIDList, taking the first link of each light that is on the route
+        for program_index in sorted({
+            program_index
+            for edge_pair in edge_pairs
+            for program_index in self._lights_by_edge_pair.get(edge_pair, ())
+        }):
+            program = self._programs[program_index]
+            for edge_pair in program.link_edge_pairs:
+                if edge_pair in edge_pairs:
+                    traffic_lights.append((program, edge_pair[0], edge_pair[1], edges.index(edge_pair[0])))
+                    break
+        return tuple(traffic_lights)
+
+    def _index(self):
+        self._programs = [
+            TrafficLightProgram(traffic_light_id) for traffic_light_id in traci.trafficlight.getIDList()
+        ]
+        self._lights_by_edge_pair = {}
+        for program_index, program in enumerate(self._programs):
+            for edge_pair in set(program.link_edge_pairs):
+                if edge_pair:
+                    self._lights_by_edge_pair.setdefault(edge_pair, []).append(program_index)
+
+
+class TrafficLight:
+    """A vehicle's view of a light on its route, sharing the light's program with other vehicles"""
+
+    __slots__ = ("program", "edge_from", "edge_to", "route_index", "current_distance", "status", "advance_phase_on_clear")
+
+    def __init__(self, program, edge_from, edge_to, route_index, advance_phase_on_clear=False):
+        self.program = program
         self.edge_from = edge_from
         self.edge_to = edge_to
+        self.route_index = route_index
         self.current_distance = 0
         self.status = TrafficLightState.NONE
-        self.original_logic = traci.trafficlight.getAllProgramLogics(self.id)[0]
-        self.unfavourable_phase_id = 0
         self.advance_phase_on_clear = advance_phase_on_clear
 
+    @property
+    def id(self):
+        return self.program.id
+
+    @property
+    def original_logic(self):
+        return self.program.original_logic
+
     def force(self, vehicle_id, route_edge_pairs):
         self.status = TrafficLightState.FORCED
         print(f"FORCED: {self.id}")
         current_state = traci.trafficlight.getRedYellowGreenState(self.id)
         new_state = ""
-        for i, link in enumerate(traci.trafficlight.getControlledLinks(self.id)):
-            from_edge = lane_to_edge(link[0][0])
-            to_edge = lane_to_edge(link[0][1])
-            if (from_edge, to_edge) in route_edge_pairs:
+        for i, edge_pair in enumerate(self.program.link_edge_pairs):
+            if edge_pair in route_edge_pairs:
                 if current_state[i] == "G":
                     new_state = current_state
                     break
@@ -50,17 +147,9 @@ class TrafficLight:
 
         self.status = TrafficLightState.BIASED
 
-        state_positions_on_route = set()
-        for i, link in enumerate(traci.trafficlight.getControlledLinks(self.id)):
-            # TODO: Remove this bare exception
-            try:
-                from_edge = lane_to_edge(link[0][0])
-                to_edge = lane_to_edge(link[0][1])
-                if (from_edge, to_edge) in route_edge_pairs:
-                    # index i is on route
-                    state_positions_on_route.add(i)
-            except:
-                pass
+        state_positions_on_route = {
+            i for i, edge_pair in enumerate(self.program.link_edge_pairs) if edge_pair in route_edge_pairs
+        }
 
         phases = []
         logic = traci.trafficlight.getAllProgramLogics(self.id)[0]
@@ -101,57 +190,53 @@ class TrafficLight:
 
 
 class Vehicle:
-    def __init__(self, vehicle, bias_mode):
+    __slots__ = ("id", "bias_mode", "route", "_traffic_lights_on_route")
+
+    def __init__(self, vehicle, bias_mode, network=None):
+        """network (a TrafficLightNetwork) shares light programs and routes with other vehicles"""
         self.id = vehicle
         self.bias_mode = bias_mode
-        self._route = traci.vehicle.getRoute(vehicle)
-        self._route_edge_pairs = self.calculate_route_edge_pairs()
-        self._traffic_lights_on_route = self.calculate_traffic_lights_on_route()
+        self.route = (network or TrafficLightNetwork()).route(traci.vehicle.getRoute(vehicle))
+        self._traffic_lights_on_route = tuple(
+            TrafficLight(program, edge_from, edge_to, route_index, advance_phase_on_clear=bias_mode)
+            for program, edge_from, edge_to, route_index in self.route.traffic_lights
+        )
+
+    @property
+    def _route(self):
+        return self.route.edges
+
+    @property
+    def _route_edge_pairs(self):
+        return self.route.edge_pairs
 
-    def calculate_traffic_light_distances(self, force_threshold, bias_threshold, bias_multiplier):
-        current_route = self._route
+    def calculate_traffic_light_distances(self, force_threshold, bias_threshold, bias_multiplier, defer_bias=False):
+        """
+        Forces, biases and clears the lights on the route from their distance to the vehicle.
+        With defer_bias the lights due a bias are returned instead of being biased.
+        """
+        to_bias = []
         current_route_index = traci.vehicle.getRouteIndex(self.id)
         current_lane = traci.vehicle.getLaneID(self.id)
         remaining_distance_on_current_edge = traci.lane.getLength(current_lane) - traci.vehicle.getLanePosition(self.id)
-        edge_lengths = {
-            edge_id: traci.lane.getLength(f"{edge_id}_0")
-            for edge_id in current_route
-        }
+        edge_offsets = self.route.edge_offsets
         for traffic_light in self._traffic_lights_on_route:
-            traffic_light_index = current_route.index(traffic_light.edge_from)
+            traffic_light_index = traffic_light.route_index
             if traffic_light_index < current_route_index:
                 # passed the TL already
                 distance = -1
                 if traffic_light.status is not TrafficLightState.NONE:
                     traffic_light.clear(self.id)
             else:
-                distance = remaining_distance_on_current_edge
-                for x in range(current_route_index + 1, traffic_light_index + 1):
-                    distance += edge_lengths[current_route[x]]
+                distance = remaining_distance_on_current_edge + (
+                    edge_offsets[traffic_light_index + 1] - edge_offsets[current_route_index + 1]
+                )
             traffic_light.current_distance = distance
             if 0 <= traffic_light.current_distance < force_threshold and traffic_light.status is not TrafficLightState.FORCED:
                 traffic_light.force(self.id, self._route_edge_pairs)
             elif self.bias_mode and force_threshold <= traffic_light.current_distance < bias_threshold and traffic_light.status is TrafficLightState.NONE:
-                traffic_light.bias(bias_multiplier, self._route_edge_pairs)
-
-    def calculate_route_edge_pairs(self):
-        edge_pairs = set()
-        for i, edge in enumerate(self._route):
-            if i == len(self._route) - 1:
-                break
-            edge_pairs.add((edge, self._route[i+1]))
-        return edge_pairs
-
-    def calculate_traffic_lights_on_route(self):
-        traffic_lights_on_route = []
-        traffic_light_ids = traci.trafficlight.getIDList()
-        for traffic_light_id in traffic_light_ids:
-            links = traci.trafficlight.getControlledLinks(traffic_light_id)
-            for link in links:
-                from_edge = lane_to_edge(link[0][0])
-                to_edge = lane_to_edge(link[0][1])
-                edge_pair = (from_edge, to_edge)
-                if edge_pair in self._route_edge_pairs:
-                    traffic_lights_on_route.append(TrafficLight(traffic_light_id, from_edge, to_edge, advance_phase_on_clear=self.bias_mode))
-                    break
-        return traffic_lights_on_route
+                if defer_bias:
+                    to_bias.append(traffic_light)
+                else:
+                    traffic_light.bias(bias_multiplier, self._route_edge_pairs)
+        return to_bias